@@ -7,35 +7,35 @@ from datetime import datetime
 from os import environ, path
 
 # library
-import rollbar
-from rollbar.contrib.flask import report_exception
-from flask import Flask, got_request_exception
-from flask_mail import Mail
-from flask_mongoengine import MongoEngine
-from mailchimp3 import MailChimp
-from pymongo import MongoClient
+from flask import Flask, current_app, got_request_exception
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-app = Flask(__name__)
-app.config.from_pyfile("config.py")
+# module
+from avwx_account import extensions
+from avwx_account.extensions import db, mdb
 
 
-def load_env():
+def load_env(app: Flask):
     """Load config vars from env
     These will overwrite vars in config.py and .env if found
     """
     for key in (
+        "CACHE_REDIS_URL",
         "MAIL_PASSWORD",
         "MAIL_USERNAME",
         "MC_KEY",
         "MC_LIST_ID",
         "MC_USERNAME",
+        "METRICS_TOKEN",
         "MONGO_URI",
+        "RATELIMIT_REDIS_URL",
         "ROOT_URL",
         "SECRET_KEY",
         "SECURITY_PASSWORD_SALT",
         "STRIPE_PUB_KEY",
         "STRIPE_SECRET_KEY",
         "STRIPE_SIGN_SECRET",
+        "USAGE_BACKEND",
         "RECAPTCHA_PUBLIC_KEY",
         "RECAPTCHA_PRIVATE_KEY",
     ):
@@ -43,41 +43,103 @@ def load_env():
         if value is not None:
             app.config[key] = value
 
-    app.config["MONGODB_SETTINGS"] = {"db": "account", "host": app.config["MONGO_URI"]}
-
-
-load_env()
+    for key in (
+        "ADMIN_ENABLED",
+        "METRICS_ALLOW_LOCAL",
+        "METRICS_ENABLED",
+        "PROFILER_ENABLED",
+        "RATELIMIT_ENABLED",
+    ):
+        # Empty values keep the config default
+        value = environ.get(key)
+        if value:
+            app.config[key] = value.lower() in ("1", "true", "yes")
+    value = environ.get("PROXY_FIX_X_FOR")
+    if value:
+        app.config["PROXY_FIX_X_FOR"] = int(value)
+    if app.config["PROFILER_ENABLED"] is None:
+        app.config["PROFILER_ENABLED"] = app.env == "development"
 
-db = MongoEngine(app)
-mdb = MongoClient(app.config["MONGO_URI"])
-mail = Mail(app)
-mc = MailChimp(mc_api=app.config["MC_KEY"], mc_user=app.config["MC_USERNAME"])
+    app.config["MONGODB_SETTINGS"] = {"db": "account", "host": app.config["MONGO_URI"]}
 
 
-@app.before_first_request
 def init_rollbar():
     """Initialize Rollbar exception logging"""
+    # pylint: disable=import-outside-toplevel
     key = environ.get("LOG_KEY")
-    if not (key and app.env == "production"):
+    if not (key and current_app.env == "production"):
         return
+    import rollbar
+    from rollbar.contrib.flask import report_exception
+
     rollbar.init(
         key,
         root=path.dirname(path.realpath(__file__)),
         allow_logging_basic_config=False,
     )
-    got_request_exception.connect(report_exception, app)
+    got_request_exception.connect(report_exception, current_app._get_current_object())
 
 
-@app.template_filter("timestamp")
 def format_timestamp(value: int, dt_format: str = r"%d %b %Y %I:%M %p") -> str:
     """Formats a timestamp int into a datetime string"""
     return datetime.fromtimestamp(value).strftime(dt_format)
 
 
-@app.template_filter("datetime")
 def format_datetime(value: datetime, dt_format: str = r"%d %b %Y %I:%M %p") -> str:
     """Formats a datetime object into a datetime string"""
     return value.strftime(dt_format)
 
 
-from avwx_account import admin, graphs, user_manager, views
+def create_app() -> Flask:
+    """Create and configure the portal app"""
+    # pylint: disable=import-outside-toplevel
+    import stripe
+
+    from avwx_account import (
+        assets,
+        cache,
+        graphs,
+        indexes,
+        limiter,
+        user_manager,
+        views,
+    )
+
+    app = Flask(__name__)
+    app.config.from_pyfile("config.py")
+    load_env(app)
+    # Only trust X-Forwarded-For behind known proxies, or clients could spoof
+    # their address past per-IP rate limits and the local metrics check
+    if app.config["PROXY_FIX_X_FOR"]:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_FIX_X_FOR"])
+
+    # Instrumentation must be initialized before the Mongo clients to register listeners
+    if app.config["METRICS_ENABLED"]:
+        from avwx_account import metrics
+
+        metrics.init_app(app)
+    if app.config["PROFILER_ENABLED"]:
+        from avwx_account import profiler
+
+        profiler.init_app(app)
+
+    db.init_app(app)
+    extensions.mail.init_app(app)
+    assets.init_app(app)
+    cache.init_app(app)
+    limiter.init_app(app)
+    stripe.api_key = app.config["STRIPE_SECRET_KEY"]
+
+    app.before_first_request(init_rollbar)
+    app.before_first_request(indexes.ensure_unique)
+    app.add_template_filter(format_timestamp, "timestamp")
+    app.add_template_filter(format_datetime, "datetime")
+
+    for blueprint in (*views.BLUEPRINTS, graphs.bp):
+        app.register_blueprint(blueprint)
+    user_manager.init_app(app)
+    if app.config["ADMIN_ENABLED"]:
+        from avwx_account import admin
+
+        admin.init_app(app)
+    return app
@@ -2,18 +2,27 @@
 Customizes the admin portal
 """
 
+# stdlib
+import re
+from typing import Optional, Tuple
+
 # library
+from bson import ObjectId
+from flask import Flask, g, request
 from flask_admin import Admin, AdminIndexView
 from flask_admin.contrib.mongoengine import ModelView
 from flask_admin.form import SecureForm
 from flask_security.utils import encrypt_password
 from flask_user import current_user
+from mongoengine import Q
 from wtforms.fields import PasswordField
 
 # module
-from avwx_account import app
 from avwx_account.models import Plan, User
 
+# Query args used to carry the keyset cursor between list pages
+_CURSOR_ARGS = ("after", "before")
+
 
 class AuthIndexView(AdminIndexView):
     def is_accessible(self):
@@ -32,6 +41,11 @@ class UserAdmin(AuthModel):
     form_base_class = SecureForm
     column_auto_select_related = True
 
+    # Search is handled by _search. This only enables the search box
+    column_searchable_list = ("email",)
+    column_default_sort = ("id", True)
+    simple_list_pager = True
+
     def scaffold_form(self) -> SecureForm:
         """Add a change password field to User form"""
         form_class = super().scaffold_form()
@@ -43,8 +57,101 @@ class UserAdmin(AuthModel):
         if model.password2:
             model.password = encrypt_password(model.password2)
 
+    def search_placeholder(self) -> str:
+        return "Email, customer ID, token, or plan key"
+
+    def _search(self, query, search_term: str):
+        """Anchored prefix search so each branch can use its index"""
+        term = search_term.strip()
+        prefix = re.compile("^" + re.escape(term))
+        criteria = (
+            Q(email=prefix)
+            | Q(stripe__customer_id=prefix)
+            | Q(tokens__value=prefix)
+            | Q(plan__key=term)
+        )
+        return query.filter(criteria)
+
+    @staticmethod
+    def _page_cursor() -> Optional[Tuple[str, ObjectId]]:
+        """Returns the keyset direction and boundary ID from the request"""
+        for key in _CURSOR_ARGS:
+            value = request.args.get(key)
+            if value and ObjectId.is_valid(value):
+                return key, ObjectId(value)
+        return None
+
+    def get_list(
+        self,
+        page,
+        sort_column,
+        sort_desc,
+        search,
+        filters,
+        execute=True,
+        page_size=None,
+    ):
+        """Keyset paginate on _id when using the default sort
+
+        Falls back to skip/limit when sorting by a column or jumping pages.
+        Unfiltered lists report the collection's estimated count
+        """
+        cursor = None if sort_column else self._page_cursor()
+        _, query = super().get_list(
+            0 if cursor else page,
+            sort_column,
+            sort_desc,
+            search,
+            filters,
+            execute=False,
+            page_size=page_size,
+        )
+        count = None
+        if not (search or filters):
+            count = self.model._get_collection().estimated_document_count()
+        reverse = False
+        if cursor:
+            direction, oid = cursor
+            if direction == "after":
+                query = query.filter(id__lt=oid)
+            else:
+                query = query.filter(id__gt=oid).order_by("id")
+                reverse = True
+        if not execute:
+            return count, query
+        data = list(query)
+        if reverse:
+            data.reverse()
+        if data and not sort_column:
+            g.admin_page_bounds = (page, data[0].id, data[-1].id)
+        return count, data
+
+    def _get_list_extra_args(self):
+        view_args = super()._get_list_extra_args()
+        for key in _CURSOR_ARGS:
+            view_args.extra_args.pop(key, None)
+        return view_args
+
+    def _get_list_url(self, view_args) -> str:
+        """Attach a keyset cursor to links for the adjacent pages"""
+        bounds = g.get("admin_page_bounds")
+        if bounds and view_args.sort is None:
+            page, first, last = bounds
+            view_args = view_args.clone()
+            if view_args.page == page + 1:
+                view_args.extra_args["after"] = str(last)
+            elif view_args.page == page - 1 and page > 1:
+                view_args.extra_args["before"] = str(first)
+        return super()._get_list_url(view_args)
+
+
+admin = Admin(index_view=AuthIndexView())
+
+# Prefixed endpoints keep the view blueprints from colliding with the app's
+admin.add_view(UserAdmin(User, endpoint="admin_user", url="user"))
+admin.add_view(AuthModel(Plan, endpoint="admin_plan", url="plan"))
 
-admin = Admin(app, index_view=AuthIndexView())
 
-admin.add_view(UserAdmin(User))
-admin.add_view(AuthModel(Plan))
+def init_app(app: Flask):
+    """Register the admin portal views"""
+    admin.init_app(app)
@@ -0,0 +1,72 @@
+"""
+Fingerprinted and precompressed static asset serving
+
+Assets are built into static/dist by utils/build_assets.py
+"""
+
+# stdlib
+import json
+import mimetypes
+from os import path
+
+# library
+from flask import Flask, Response, current_app, request, send_from_directory, url_for
+from werkzeug.security import safe_join
+
+MANIFEST = path.join("dist", "manifest.json")
+
+# Checked in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def load_manifest(static_folder: str) -> dict:
+    """Returns the source to fingerprinted path map if assets have been built"""
+    try:
+        with open(path.join(static_folder, MANIFEST)) as fin:
+            return json.load(fin)
+    except FileNotFoundError:
+        return {}
+
+
+def asset_url(filename: str) -> str:
+    """Returns the URL of an asset's fingerprinted build if available"""
+    manifest = current_app.extensions["assets"]
+    return url_for("static", filename=manifest.get(filename, filename))
+
+
+def _precompressed(filename: str) -> tuple:
+    """Returns the best encoding and file suffix the client accepts"""
+    accepted = request.accept_encodings
+    for encoding, suffix in ENCODINGS:
+        if encoding not in accepted:
+            continue
+        target = safe_join(current_app.static_folder, filename + suffix)
+        if target and path.isfile(target):
+            return encoding, suffix
+    return None, ""
+
+
+def serve_static(filename: str) -> Response:
+    """Serves static files, preferring precompressed builds"""
+    encoding, suffix = _precompressed(filename)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    response = send_from_directory(
+        current_app.static_folder, filename + suffix, mimetype=mimetype
+    )
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    if filename in current_app.extensions["assets_built"]:
+        response.headers["Cache-Control"] = IMMUTABLE
+    return response
+
+
+def init_app(app: Flask):
+    """Replace the default static view and add the asset_url template helper"""
+    manifest = load_manifest(app.static_folder)
+    app.extensions["assets"] = manifest
+    app.extensions["assets_built"] = set(manifest.values())
+    app.view_functions["static"] = serve_static
+    app.add_template_global(asset_url)
@@ -0,0 +1,212 @@
+"""
+Rendered fragment, page, and webhook lookup caching
+
+Fragments are keyed by the plan catalog version and whatever document
+versions they depend on, so entries never need explicit invalidation.
+Webhook lookups are short-lived and cleared when the document is saved.
+Only a customer's user ID is cached, so the user itself is loaded fresh
+before webhooks modify and save it
+"""
+
+# stdlib
+import json
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Optional, Type
+
+# library
+from bson import json_util
+from flask import Flask, current_app, g, has_app_context
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from mongoengine import Document, signals
+
+# module
+from avwx_account.extensions import mdb
+from avwx_account.models import Plan, User
+
+
+class MemoryCache:
+    """Thread-safe LRU cache with per-entry expiration"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: int):
+        with self._lock:
+            self._data[key] = (value, monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class RedisCache:
+    """Cache shared between workers. Values must be JSON serializable"""
+
+    def __init__(self, url: str, prefix: str = "avwx:"):
+        # pylint: disable=import-outside-toplevel
+        import redis
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: int):
+        self._client.set(self.prefix + key, json.dumps(value), ex=ttl)
+
+    def delete(self, key: str):
+        self._client.delete(self.prefix + key)
+
+
+def get_cache() -> MemoryCache:
+    return current_app.extensions["cache"]
+
+
+def cached(key: str, render: Callable[[], str], ttl: Optional[int] = None) -> str:
+    """Returns a cached value or renders and stores it"""
+    cache = get_cache()
+    value = cache.get(key)
+    if value is None:
+        value = render()
+        cache.set(key, value, ttl or current_app.config["CACHE_TTL"])
+    return value
+
+
+def catalog_version() -> str:
+    """Returns the plan catalog version from the plans stored in Mongo
+
+    Every worker reads the same data, so a change made through any of
+    them is seen by all. Looked up once per request
+    """
+    if "catalog_version" not in g:
+        rows = list(
+            mdb.account.plan.aggregate(
+                [
+                    {
+                        "$group": {
+                            "_id": None,
+                            "updated": {"$max": "$updated"},
+                            "count": {"$sum": 1},
+                        }
+                    }
+                ]
+            )
+        )
+        row = rows[0] if rows else {}
+        updated = row.get("updated")
+        stamp = int(updated.timestamp() * 1000) if updated else 0
+        g.catalog_version = f"{row.get('count', 0)}.{stamp}"
+    return g.catalog_version
+
+
+def cached_page(name: str, render: Callable[[], str]) -> str:
+    """Returns a full page that only depends on the plan catalog"""
+    return cached(f"page:{name}:{catalog_version()}", render)
+
+
+class FragmentCache(Extension):
+    """Adds a {% cache "name", key, ... %}...{% endcache %} template block"""
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        call = self.call_method("_render", [nodes.List(parts)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    @staticmethod
+    def _render(parts: list, caller: Callable[[], str]) -> Markup:
+        key = "fragment:" + ":".join(str(part) for part in parts)
+        return Markup(cached(key, lambda: str(caller())))
+
+
+def _lookup(key: str, model: Type[Document], **query) -> Optional[Document]:
+    """Returns a document from the cache or loads and stores it"""
+    cache = get_cache()
+    value = cache.get(key)
+    if value is not None:
+        # pylint: disable=protected-access
+        return model._from_son(json_util.loads(value))
+    doc = model.objects(**query).first()
+    if doc is not None:
+        cache.set(key, doc.to_json(), current_app.config["CACHE_LOOKUP_TTL"])
+    return doc
+
+
+def plan_by_price(price_id: str) -> Optional[Plan]:
+    """Cached Stripe price to plan lookup for webhook processing"""
+    return _lookup(f"plan:price:{price_id}", Plan, stripe_id=price_id)
+
+
+def user_by_customer(customer_id: str) -> Optional[User]:
+    """Stripe customer to user lookup for webhook processing
+
+    The customer to user ID mapping is cached, but the document is always
+    loaded by _id so a save never writes back a stale copy
+    """
+    cache = get_cache()
+    key = f"user:customer:{customer_id}"
+    user_id = cache.get(key)
+    if user_id is not None:
+        user = User.objects(id=user_id).first()
+        if user and user.stripe and user.stripe.customer_id == customer_id:
+            return user
+        cache.delete(key)
+    user = User.by_customer_id(customer_id)
+    if user is not None:
+        cache.set(key, str(user.id), current_app.config["CACHE_LOOKUP_TTL"])
+    return user
+
+
+def _clear_user(_, document: User, **__):
+    """Clear this worker's customer lookup when a user is changed"""
+    if has_app_context() and document.stripe and document.stripe.customer_id:
+        get_cache().delete(f"user:customer:{document.stripe.customer_id}")
+
+
+def _clear_plan(_, document: Optional[Plan] = None, **__):
+    """Clear this worker's price lookup when a plan is changed"""
+    if has_app_context() and document is not None and document.stripe_id:
+        get_cache().delete(f"plan:price:{document.stripe_id}")
+
+
+def init_app(app: Flask):
+    """Attach the cache backend, template tag, and invalidation signals"""
+    url = app.config.get("CACHE_REDIS_URL")
+    if url:
+        app.extensions["cache"] = RedisCache(url)
+    else:
+        app.extensions["cache"] = MemoryCache(app.config["CACHE_MAX_ENTRIES"])
+    app.jinja_env.add_extension(FragmentCache)
+    app.add_template_global(catalog_version)
+    signals.post_save.connect(_clear_plan, sender=Plan)
+    signals.post_delete.connect(_clear_plan, sender=Plan)
+    signals.post_save.connect(_clear_user, sender=User)
+    signals.post_delete.connect(_clear_user, sender=User)
@@ -22,11 +22,11 @@ USER_ENABLE_EMAIL = True
 USER_ENABLE_USERNAME = False
 USER_EMAIL_SENDER_NAME = USER_APP_NAME
 USER_EMAIL_SENDER_EMAIL = "noreply@avwx.rest"
-USER_AFTER_CHANGE_PASSWORD_ENDPOINT = "manage"
-USER_AFTER_CONFIRM_ENDPOINT = "manage"
-USER_AFTER_EDIT_USER_PROFILE_ENDPOINT = "manage"
-USER_AFTER_FORGOT_PASSWORD_ENDPOINT = "manage"
-USER_AFTER_LOGIN_ENDPOINT = "manage"
+USER_AFTER_CHANGE_PASSWORD_ENDPOINT = "home.manage"
+USER_AFTER_CONFIRM_ENDPOINT = "home.manage"
+USER_AFTER_EDIT_USER_PROFILE_ENDPOINT = "home.manage"
+USER_AFTER_FORGOT_PASSWORD_ENDPOINT = "home.manage"
+USER_AFTER_LOGIN_ENDPOINT = "home.manage"
 
 # Mailchimp Mailing List
 MC_KEY = "mc api key"
@@ -41,6 +41,43 @@ ROOT_URL = "http://use.ngrok.for.this.locally/"
 STRIPE_PUB_KEY = "stripe public key"
 STRIPE_SECRET_KEY = "stripe secret key"
 STRIPE_SIGN_SECRET = "stripe webhook signing key"
+# Reuse Checkout sessions for a user and plan until just before Stripe expires them
+CHECKOUT_SESSION_TTL = 23 * 60 * 60
+
+# Rendered fragment cache. Set CACHE_REDIS_URL to share between workers (requires redis)
+CACHE_MAX_ENTRIES = 2048
+CACHE_TTL = 600
+# Webhook customer and plan lookups. Saves clear them sooner
+CACHE_LOOKUP_TTL = 60
+CACHE_REDIS_URL = None
+
+# Sliding window limits per user and IP as (requests, seconds)
+# Set RATELIMIT_REDIS_URL to share between workers (requires redis)
+RATELIMIT_ENABLED = True
+RATELIMITS = {"token": (10, 60), "register": (5, 3600)}
+RATELIMIT_REDIS_URL = None
+
+# Token usage storage. "daily" reads account.token
+# "timeseries" reads the account.token_usage time-series collection (MongoDB 5.0+)
+USAGE_BACKEND = "daily"
+
+# Number of trusted proxies setting X-Forwarded-For. Heroku's router is one
+# Leave at 0 unless the app only receives traffic through those proxies
+PROXY_FIX_X_FOR = 0
+
+# Register the Flask-Admin views
+ADMIN_ENABLED = True
+
+# Prometheus metrics and request timing
+# Set PROMETHEUS_MULTIPROC_DIR to aggregate across gunicorn workers
+# /metrics needs METRICS_TOKEN, or METRICS_ALLOW_LOCAL for localhost scrapes
+METRICS_ENABLED = False
+METRICS_TOKEN = None
+METRICS_ALLOW_LOCAL = False
+
+# Development query profiler. Defaults to on when FLASK_ENV is development
+PROFILER_ENABLED = None
+PROFILER_QUERY_BUDGET = 10
 
 # reCAPTCHA
 RECAPTCHA_USE_SSL = True
@@ -0,0 +1,74 @@
+"""
+Shared extensions and lazily created external clients
+
+Importing this module doesn't connect to anything, so models and
+scripts can use it without building the Flask app
+"""
+
+# stdlib
+from os import environ
+
+# library
+from flask import current_app, has_app_context
+from flask_mail import Mail
+from flask_mongoengine import MongoEngine
+from pymongo import MongoClient
+from werkzeug.local import LocalProxy
+
+db = MongoEngine()
+mail = Mail()
+
+_CLIENTS = {}
+
+
+def _config(key: str) -> str:
+    """Returns a config value from the current app or the environment"""
+    if has_app_context():
+        return current_app.config[key]
+    return environ[key]
+
+
+def get_mongo() -> MongoClient:
+    """Returns the shared Mongo client, creating it on first use"""
+    client = _CLIENTS.get("mongo")
+    if client is None:
+        client = _CLIENTS["mongo"] = MongoClient(_config("MONGO_URI"))
+    return client
+
+
+def get_mailchimp() -> "MailChimp":
+    """Returns the shared MailChimp client, creating it on first use"""
+    client = _CLIENTS.get("mailchimp")
+    if client is None:
+        # pylint: disable=import-outside-toplevel
+        from mailchimp3 import MailChimp
+
+        client = _CLIENTS["mailchimp"] = MailChimp(
+            mc_api=_config("MC_KEY"), mc_user=_config("MC_USERNAME")
+        )
+        if has_app_context() and "mailchimp_hooks" in current_app.extensions:
+            client.request_hooks = current_app.extensions["mailchimp_hooks"]
+    return client
+
+
+def reset_clients():
+    """Forget clients inherited from a parent process
+
+    Mongo clients aren't fork safe. Gunicorn calls this in each worker
+    after forking a preloaded app so clients are recreated on first use
+    """
+    # pylint: disable=import-outside-toplevel,protected-access
+    from mongoengine import Document, connection
+    from mongoengine.base.common import _document_registry
+
+    # Dropped without closing since the sockets are shared with the parent
+    _CLIENTS.clear()
+    connection._connections.clear()
+    connection._dbs.clear()
+    for doc_cls in _document_registry.values():
+        if issubclass(doc_cls, Document):
+            doc_cls._disconnect()
+
+
+mdb = LocalProxy(get_mongo)
+mc = LocalProxy(get_mailchimp)
@@ -5,58 +5,102 @@ Application graph views
 # pylint: disable=missing-function-docstring,protected-access
 
 # stdlib
-import json
-from typing import List
+from typing import List, Optional, Tuple
 
 # library
-from flask import redirect, render_template, request, url_for
+import orjson
+from flask import Blueprint, Response, redirect, render_template, request, url_for
 from flask_user import login_required, current_user
 
-# module
-from avwx_account import app
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
-COLORS = ("red", "orange", "yellow", "green", "blue", "purple", "pink")
+# app
+from avwx_account.usage import timezones
 
+bp = Blueprint("graphs", __name__)
 
-def format_count(
-    label: str, counts: List[int], color: str, dashed: bool = False
-) -> dict:
-    """Format a line dataset for chart.js"""
-    ret = {
-        "label": label,
-        "data": counts,
-        "borderColor": color,
-        "borderWidth": 2,
-        "fill": False,
-    }
-    if dashed:
-        ret["borderDash"] = [5, 5]
-    return ret
+MSGPACK = "application/msgpack"
 
 
-@app.route("/token/usage")
-@login_required
-def token_usage():
-    token_type = request.args.get("type", "app")
-    target = request.args.get("value")
+def delta_encode(values: List[int]) -> List[int]:
+    """First value followed by the change from each previous value"""
+    return [b - a for a, b in zip([0] + values, values)]
+
+
+def usage_payload(token_type: str, target: Optional[str], hourly: bool) -> dict:
+    """Compact columnar usage counts for the current user
+
+    Chart styling and labels are applied client-side from the period,
+    start, and the index of each token in the user's list
+    """
     if target:
         try:
             target = current_user.get_token(target)._id
-        except:
-            pass
-    counts = current_user.token_usage()
+        except AttributeError:
+            target = None
+    if hourly:
+        counts = current_user.token_usage_hourly()
+    else:
+        counts = current_user.token_usage()
     if not counts:
-        return redirect(url_for("manage"))
-    labels = json.dumps([d.strftime("%b %d") for d in counts["days"]])
-    data = []
-    if token_type != "dev":
-        data.append(format_count("Total", counts["total"], "black", dashed=True))
-    for i, item in enumerate(counts[token_type].items()):
-        token_id, counts = item
-        token = current_user.get_token(_id=token_id)
-        if target and token._id != target:
+        return {}
+    if hourly:
+        start = counts["hours"][0].isoformat() + "Z"
+    else:
+        start = counts["days"][0].isoformat()
+    names = {token._id: token.name for token in current_user.tokens}
+    ret = {
+        "period": "hour" if hourly else "day",
+        "start": start,
+        # Days may be UTC buckets, but hour labels are always converted
+        "tz": (current_user.timezone or "UTC") if hourly else counts["tz"],
+        "total": None if token_type == "dev" else delta_encode(counts["total"]),
+        "names": [],
+        "colors": [],
+        "counts": [],
+    }
+    for i, (token_id, values) in enumerate(counts[token_type].items()):
+        if target and token_id != target:
             continue
-        color = COLORS[i % len(COLORS)]
-        data.append(format_count(token.name, counts, color))
-    data = json.dumps(data)
-    return render_template("token_usage.html", labels=labels, data=data)
+        ret["names"].append(names[token_id])
+        ret["colors"].append(i)
+        ret["counts"].append(delta_encode(values))
+    return ret
+
+
+def encode(payload: dict, fmt: str = "json") -> Tuple[bytes, str]:
+    """Serialize a payload as JSON, or MessagePack if requested and installed"""
+    if fmt == "msgpack" and msgpack:
+        return msgpack.packb(payload), MSGPACK
+    return orjson.dumps(payload), "application/json"
+
+
+@bp.route("/token/usage")
+@login_required
+def token_usage():
+    if not current_user.tokens:
+        return redirect(url_for("home.manage"))
+    return render_template(
+        "token_usage.html",
+        data_url=url_for("graphs.usage_data", **request.args),
+        hourly=request.args.get("period") == "hour",
+        timezones=sorted(timezones()),
+    )
+
+
+@bp.route("/token/usage/data")
+@login_required
+def usage_data():
+    payload = usage_payload(
+        request.args.get("type", "app"),
+        request.args.get("value"),
+        request.args.get("period") == "hour",
+    )
+    fmt = request.args.get("format")
+    if fmt is None and request.accept_mimetypes.best == MSGPACK:
+        fmt = "msgpack"
+    data, mimetype = encode(payload, fmt)
+    return Response(data, mimetype=mimetype)
@@ -0,0 +1,137 @@
+"""
+Declare, diff, build, and verify the account database indexes
+
+Models don't build their indexes on first access. The declared set is
+managed here and by utils/indexes.py
+"""
+
+# stdlib
+from typing import Dict, Iterator, List, Tuple
+
+# library
+from bson import ObjectId
+from pymongo import IndexModel
+
+# module
+from avwx_account.extensions import mdb
+from avwx_account.models import RAW_INDEXES, Addon, Plan, User
+
+IndexKey = Tuple[Tuple[str, int], ...]
+
+# Queries on the request and job paths that must be served by an index
+HOT_QUERIES = (
+    ("user", {"email": "user@example.com"}),
+    ("user", {"stripe.customer_id": "cus_example"}),
+    ("user", {"tokens.value": "example"}),
+    ("user", {"plan.key": "free"}),
+    ("user", {"email_confirmed_at": {"$exists": 0}}),
+    ("user", {"deleted_at": {"$exists": 1}}),
+    ("plan", {"key": "free"}),
+    ("plan", {"stripe_id": "price_example"}),
+    ("addon", {"key": "overage"}),
+    ("token", {"user_id": ObjectId(), "date": {"$gte": ObjectId().generation_time}}),
+    (
+        "token_usage",
+        {"meta.user_id": ObjectId(), "timestamp": {"$gte": ObjectId().generation_time}},
+    ),
+)
+
+
+def declared() -> Dict[str, List[dict]]:
+    """Returns the declared index specs keyed by collection name
+
+    Raw collections are skipped until they exist. Creating an index would
+    otherwise create token_usage as a regular collection
+    """
+    specs = {
+        model._meta["collection"]: model._meta["index_specs"]
+        for model in (Addon, Plan, User)
+    }
+    present = set(mdb.account.list_collection_names())
+    specs.update({k: v for k, v in RAW_INDEXES.items() if k in present})
+    return specs
+
+
+def _key(fields: list) -> IndexKey:
+    return tuple((name, int(direction)) for name, direction in fields)
+
+
+def existing(collection: str) -> Dict[IndexKey, str]:
+    """Returns the current index names keyed by their fields"""
+    info = mdb.account[collection].index_information()
+    return {_key(index["key"]): name for name, index in info.items()}
+
+
+def diff() -> Dict[str, dict]:
+    """Returns missing index specs and undeclared index names per collection"""
+    ret = {}
+    for collection, specs in declared().items():
+        current = existing(collection)
+        wanted = {_key(spec["fields"]) for spec in specs}
+        ret[collection] = {
+            "missing": [s for s in specs if _key(s["fields"]) not in current],
+            "extra": [
+                name
+                for key, name in current.items()
+                if key not in wanted and name != "_id_"
+            ],
+        }
+    return ret
+
+
+def _index_model(spec: dict) -> IndexModel:
+    opts = spec.copy()
+    fields = opts.pop("fields")
+    opts.pop("cls", None)
+    return IndexModel(fields, background=True, **opts)
+
+
+def build() -> int:
+    """Create any missing indexes in the background"""
+    count = 0
+    for collection, changes in diff().items():
+        if not changes["missing"]:
+            continue
+        models = [_index_model(spec) for spec in changes["missing"]]
+        for name in mdb.account[collection].create_indexes(models):
+            print(f"Building {collection}.{name}")
+            count += 1
+    return count
+
+
+def ensure_unique() -> int:
+    """Create any missing unique indexes
+
+    These enforce data rules like one account per email rather than just
+    speeding up queries, so a fresh deploy can't run without them
+    """
+    count = 0
+    for collection, changes in diff().items():
+        models = [_index_model(s) for s in changes["missing"] if s.get("unique")]
+        if models:
+            count += len(mdb.account[collection].create_indexes(models))
+    return count
+
+
+def _stages(plan: dict) -> Iterator[str]:
+    """Yields every stage name in an explain plan tree"""
+    plan = plan.get("queryPlan", plan)
+    yield plan.get("stage")
+    if "inputStage" in plan:
+        yield from _stages(plan["inputStage"])
+    for stage in plan.get("inputStages", []):
+        yield from _stages(stage)
+
+
+def verify() -> List[Tuple[str, dict]]:
+    """Returns the hot queries whose winning plan is not index-backed"""
+    failed = []
+    present = set(mdb.account.list_collection_names())
+    for collection, query in HOT_QUERIES:
+        if collection not in present:
+            continue
+        explain = mdb.account[collection].find(query).explain()
+        stages = set(_stages(explain["queryPlanner"]["winningPlan"]))
+        if "COLLSCAN" in stages or not stages & {"IXSCAN", "IDHACK", "EXPRESS_IXSCAN"}:
+            failed.append((collection, query))
+    return failed
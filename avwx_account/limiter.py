@@ -0,0 +1,147 @@
+"""
+Sliding window rate limiting for account mutations
+
+Limits are tracked per user and per IP. Set RATELIMIT_REDIS_URL to
+share counts between workers. RateLimiter paces outgoing API calls
+made by scripts
+"""
+
+# stdlib
+from collections import deque
+from functools import wraps
+from secrets import token_hex
+from threading import Lock
+from time import monotonic, sleep, time
+from typing import Callable
+
+# library
+from flask import Flask, current_app, flash, redirect, request, url_for
+from flask_user import current_user
+
+MESSAGE = "Too many requests. Please wait a few minutes and try again"
+
+# Clear idle keys from memory after this many hits
+SWEEP_EVERY = 1000
+
+
+class RateLimiter:
+    """Spaces out calls shared between threads"""
+
+    def __init__(self, per_second: float):
+        self.interval = 1 / per_second
+        self._next = monotonic()
+        self._lock = Lock()
+
+    def wait(self):
+        with self._lock:
+            now = monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            sleep(delay)
+
+
+class MemoryWindow:
+    """Thread-safe sliding window counters for a single process"""
+
+    def __init__(self, max_window: int):
+        self.max_window = max_window
+        self._hits = {}
+        self._lock = Lock()
+        self._count = 0
+
+    def _sweep(self, now: float):
+        cutoff = now - self.max_window
+        for key in [k for k, v in self._hits.items() if not v or v[-1] < cutoff]:
+            del self._hits[key]
+
+    def hit(self, key: str, limit: int, window: int) -> bool:
+        """Records a hit and returns False if the key is over its limit"""
+        now = monotonic()
+        with self._lock:
+            self._count += 1
+            if self._count % SWEEP_EVERY == 0:
+                self._sweep(now)
+            hits = self._hits.setdefault(key, deque())
+            while hits and hits[0] <= now - window:
+                hits.popleft()
+            if len(hits) >= limit:
+                return False
+            hits.append(now)
+            return True
+
+
+class RedisWindow:
+    """Sliding window counters shared between workers using sorted sets"""
+
+    def __init__(self, url: str, prefix: str = "avwx:limit:"):
+        # pylint: disable=import-outside-toplevel
+        import redis
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def hit(self, key: str, limit: int, window: int) -> bool:
+        """Records a hit and returns False if the key is over its limit"""
+        key, now = self.prefix + key, time()
+        member = f"{now}:{token_hex(4)}"
+        pipe = self._client.pipeline()
+        pipe.zremrangebyscore(key, 0, now - window)
+        pipe.zcard(key)
+        pipe.zadd(key, {member: now})
+        pipe.expire(key, window + 1)
+        count = pipe.execute()[1]
+        if count >= limit:
+            self._client.zrem(key, member)
+            return False
+        return True
+
+
+def allowed(scope: str) -> bool:
+    """Records a hit for the current user and IP. Returns False if either is limited"""
+    config = current_app.config
+    if not config["RATELIMIT_ENABLED"]:
+        return True
+    limit, window = config["RATELIMITS"][scope]
+    backend = current_app.extensions["limiter"]
+    keys = [f"{scope}:ip:{request.remote_addr}"]
+    if current_user.is_authenticated:
+        keys.append(f"{scope}:user:{current_user.id}")
+    # Record every key so a single identity can't reset the other's window
+    return all([backend.hit(key, limit, window) for key in keys])
+
+
+def limit(scope: str) -> Callable:
+    """Limit a view. Limited requests are redirected to the account page"""
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not allowed(scope):
+                flash(MESSAGE, "error")
+                return redirect(url_for("home.manage"))
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _limit_register():
+    """Flask-User's register view can't be decorated, so check it here"""
+    if request.endpoint == "user.register" and request.method == "POST":
+        if not allowed("register"):
+            flash(MESSAGE, "error")
+            return redirect(url_for("user.register"))
+    return None
+
+
+def init_app(app: Flask):
+    """Attach the limiter backend and registration check"""
+    url = app.config.get("RATELIMIT_REDIS_URL")
+    if url:
+        app.extensions["limiter"] = RedisWindow(url)
+    else:
+        max_window = max(w for _, w in app.config["RATELIMITS"].values())
+        app.extensions["limiter"] = MemoryWindow(max_window)
+    app.before_request(_limit_register)
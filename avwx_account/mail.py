@@ -6,16 +6,17 @@ import hashlib
 from typing import Optional
 
 import rollbar
+from flask import current_app
 from mailchimp3.mailchimpclient import MailChimpError
 
-from avwx_account import app, mc
+from avwx_account.extensions import _config, mc
 
 
 def add_to_mailing_list(email: str) -> Optional[str]:
     """Add an email to the mailing list. Returns error string if not successful"""
     try:
         mc.lists.members.create(
-            app.config.get("MC_LIST_ID"),
+            current_app.config.get("MC_LIST_ID"),
             {"email_address": email, "status": "subscribed"},
         )
     except MailChimpError as exc:
@@ -31,10 +32,10 @@ def add_to_mailing_list(email: str) -> Optional[str]:
 
 
 def delete_from_mailing_list(email: str):
-    """Delete an email from the mailing list"""
+    """Delete an email from the mailing list. Works without an app context"""
     try:
         target = hashlib.md5(email.encode("utf-8")).hexdigest()
-        mc.lists.members.delete(app.config.get("MC_LIST_ID"), target)
+        mc.lists.members.delete(_config("MC_LIST_ID"), target)
     except MailChimpError as exc:
         data = dict(exc.args[0])
         if data.get("status") != 404:
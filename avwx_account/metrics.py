@@ -0,0 +1,215 @@
+"""
+Request timing and external call instrumentation
+
+Only imported when METRICS_ENABLED is set so there's no overhead otherwise
+"""
+
+# stdlib
+from os import environ
+from time import perf_counter
+
+# library
+import stripe
+from flask import (
+    Flask,
+    Response,
+    abort,
+    before_render_template,
+    current_app,
+    g,
+    has_request_context,
+    request,
+    template_rendered,
+)
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+from pymongo import monitoring
+
+# module
+from avwx_account import token_pool
+
+REQUEST_TIME = Histogram(
+    "avwx_request_seconds",
+    "Request duration",
+    ("endpoint", "method", "status"),
+)
+MONGO_COUNT = Counter(
+    "avwx_mongo_commands_total",
+    "Mongo commands issued",
+    ("endpoint", "command"),
+)
+MONGO_TIME = Histogram(
+    "avwx_mongo_seconds",
+    "Mongo command duration",
+    ("endpoint", "command"),
+)
+EXTERNAL_TIME = Histogram(
+    "avwx_external_seconds",
+    "External API call duration",
+    ("endpoint", "service"),
+)
+RENDER_TIME = Histogram(
+    "avwx_render_seconds",
+    "Template render duration",
+    ("template",),
+)
+WORKER_EVENTS = Counter(
+    "avwx_worker_events_total",
+    "Gunicorn worker starts, exits, and timeouts",
+    ("event",),
+)
+
+
+def _endpoint() -> str:
+    if has_request_context():
+        return request.endpoint or "unknown"
+    return "none"
+
+
+def _add_span(name: str, seconds: float):
+    """Add time to the current request's Server-Timing span"""
+    if has_request_context():
+        spans = g.setdefault("timing_spans", {})
+        spans[name] = spans.get(name, 0) + seconds
+
+
+def observe_external(service: str, seconds: float):
+    """Record the duration of a call to an external service"""
+    EXTERNAL_TIME.labels(_endpoint(), service).observe(seconds)
+    _add_span(service, seconds)
+
+
+class MongoListener(monitoring.CommandListener):
+    """Records Mongo command counts and durations per endpoint"""
+
+    def started(self, event):
+        pass
+
+    def _record(self, event):
+        endpoint, seconds = _endpoint(), event.duration_micros / 1e6
+        MONGO_COUNT.labels(endpoint, event.command_name).inc()
+        MONGO_TIME.labels(endpoint, event.command_name).observe(seconds)
+        _add_span("mongo", seconds)
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+
+class TimedStripeClient:
+    """Wraps a Stripe HTTP client to time each API call"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def request_with_retries(self, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return self._client.request_with_retries(*args, **kwargs)
+        finally:
+            observe_external("stripe", perf_counter() - start)
+
+
+def _mailchimp_hook(response, *_, **__):
+    observe_external("mailchimp", response.elapsed.total_seconds())
+
+
+def _start_request():
+    g.request_start = perf_counter()
+
+
+def _finish_request(response: Response) -> Response:
+    start = g.pop("request_start", None)
+    if start is None:
+        return response
+    total = perf_counter() - start
+    REQUEST_TIME.labels(
+        request.endpoint or "unknown", request.method, response.status_code
+    ).observe(total)
+    spans = g.pop("timing_spans", {})
+    spans["total"] = total
+    response.headers["Server-Timing"] = ", ".join(
+        f"{name};dur={value * 1000:.1f}" for name, value in spans.items()
+    )
+    return response
+
+
+def _start_render(_, template, **__):
+    g.render_start = perf_counter()
+
+
+def _finish_render(_, template, **__):
+    start = g.pop("render_start", None)
+    if start is None:
+        return
+    seconds = perf_counter() - start
+    RENDER_TIME.labels(template.name or "unknown").observe(seconds)
+    _add_span("render", seconds)
+
+
+class PoolCollector:
+    """Reads the token pool depth at scrape time"""
+
+    def collect(self):
+        gauge = GaugeMetricFamily(
+            "avwx_token_pool_depth", "Pre-generated token values", labels=("type",)
+        )
+        for type, count in token_pool.depth().items():
+            gauge.add_metric((type,), count)
+        yield gauge
+
+
+# Kept out of the worker registries since it's shared database state
+POOL_REGISTRY = CollectorRegistry()
+POOL_REGISTRY.register(PoolCollector())
+
+LOCAL_ADDRS = ("127.0.0.1", "::1")
+
+
+def metrics_view():
+    """Prometheus scrape endpoint aggregated across workers"""
+    token = current_app.config.get("METRICS_TOKEN")
+    if token:
+        if request.headers.get("Authorization") != f"Bearer {token}":
+            abort(401)
+    elif not (
+        current_app.config.get("METRICS_ALLOW_LOCAL")
+        and request.remote_addr in LOCAL_ADDRS
+    ):
+        # Denied unless scrapes are authenticated or limited to this host
+        abort(403)
+    registry = REGISTRY
+    if environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    output = generate_latest(registry) + generate_latest(POOL_REGISTRY)
+    return Response(output, mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app: Flask):
+    """Install instrumentation. Must run before any Mongo clients are created"""
+    monitoring.register(MongoListener())
+    stripe.default_http_client = TimedStripeClient(
+        stripe.http_client.new_default_http_client(
+            verify_ssl_certs=stripe.verify_ssl_certs, proxy=stripe.proxy
+        )
+    )
+    app.extensions["mailchimp_hooks"] = {"response": [_mailchimp_hook]}
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_start_render, app)
+    template_rendered.connect(_finish_render, app)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
@@ -1,24 +1,55 @@
 """
 Manages database models
+
+Stripe is imported where it's used to keep this module light for scripts
 """
 
+# pylint: disable=import-outside-toplevel
+
 # stdlib
+import hashlib
+import logging
 from contextlib import suppress
 from datetime import datetime, timedelta, timezone
-from secrets import token_urlsafe
 from typing import Dict, List, Optional
 
 # library
-import stripe as stripelib
-from bson import ObjectId
+from bson import BSON, ObjectId
 from flask_user import UserMixin
+from mongoengine import signals
 
 # module
-from avwx_account import db, mdb
+from avwx_account import token_pool
+from avwx_account.extensions import db, mdb
+from avwx_account.usage import HourlyStore, day_window, get_store
+
+# Used when a plan doesn't set its own token_limit
+DEFAULT_TOKEN_LIMIT = 10
+
+# Plans with more users than this are synced in _id ranges to log progress
+PLAN_SYNC_BATCH = 10_000
+
+logger = logging.getLogger(__name__)
+
+# Indexes are built by utils/indexes.py rather than on first collection access
+# Unique indexes are still ensured when the app starts serving
+INDEX_META = {"auto_create_index": False, "index_background": True}
+
+# Indexes for collections accessed without a mongoengine Document
+RAW_INDEXES = {
+    "token": [{"fields": [("user_id", 1), ("date", 1), ("token_id", 1)]}],
+    "token_usage": [{"fields": [("meta.user_id", 1), ("timestamp", 1)]}],
+    "overage": [{"fields": [("user_id", 1), ("date", 1)], "unique": True}],
+    "token_pool": [{"fields": [("type", 1)]}],
+    "token_hourly": [
+        {"fields": [("user_id", 1), ("date", 1), ("token_id", 1)], "unique": True},
+        {"fields": [("date", 1)]},
+    ],
+}
 
 
 class Addon(db.Document):
-    meta = {"strict": False}
+    meta = {"strict": False, **INDEX_META}
 
     key = db.StringField(unique=True)
     stripe_id = db.StringField()
@@ -31,6 +62,8 @@ class Addon(db.Document):
 class Stripe(db.EmbeddedDocument):
     customer_id = db.StringField()
     subscription_id = db.StringField()
+    subscription_item_id = db.StringField()
+    addon_items = db.DictField()
 
 
 class Token(db.EmbeddedDocument):
@@ -46,10 +79,7 @@ class Token(db.EmbeddedDocument):
         return resp is None
 
     def _gen(self):
-        value = token_urlsafe(32)
-        if self.type == "dev":
-            value = "dev-" + value[4:]
-        self.value = value
+        self.value = token_pool.generate(self.type)
 
     @classmethod
     def new(cls, name: str = "Token", type: str = "app"):
@@ -64,7 +94,11 @@ class Token(db.EmbeddedDocument):
         return cls.new("Development", "dev")
 
     def refresh(self):
-        """Refresh the token value"""
+        """Refresh the token value, preferring a pre-checked pooled value"""
+        value = token_pool.claim(self.type)
+        if value:
+            self.value = value
+            return
         self._gen()
         while not self.is_unique:
             self._gen()
@@ -82,6 +116,7 @@ class PlanBase:
     level = db.IntField()
     limit = db.IntField()
     overage = db.BooleanField(default=False)
+    token_limit = db.IntField()
 
     def __repr__(self) -> str:
         return f"<Plan {self.key}>"
@@ -119,8 +154,11 @@ class PlanEmbedded(db.EmbeddedDocument, PlanBase):
 
 
 class Plan(db.Document, PlanBase):
+    meta = {"strict": False, "indexes": ["stripe_id"], **INDEX_META}
 
     key = db.StringField(unique=True)
+    # Sets the plan catalog version used to key cached fragments and pages
+    updated = db.DateTimeField()
 
     @classmethod
     def by_key(cls, key: str) -> "Plan":
@@ -140,11 +178,54 @@ class Plan(db.Document, PlanBase):
             price=self.price,
             level=self.level,
             limit=self.limit,
+            overage=self.overage,
+            token_limit=self.token_limit,
         )
 
+    def sync_users(self, fields: List[str], old_key: Optional[str] = None) -> int:
+        """Copy changed fields to every user on this plan. Returns users updated
+
+        Users are updated in place rather than loaded and re-saved
+        """
+        fields = [f for f in fields if f in PlanEmbedded._fields]
+        if not fields:
+            return 0
+        data = self.to_mongo()
+        update = {"$set": {f"plan.{f}": data.get(f) for f in fields}}
+        query = {"plan.key": old_key or self.key}
+        coll = mdb.account.user
+        total = coll.count_documents(query)
+        if total <= PLAN_SYNC_BATCH:
+            return coll.update_many(query, update).modified_count
+        # Walk forward by _id so ranges still line up if the key is changing
+        updated, last = 0, None
+        while True:
+            batch = dict(query)
+            if last:
+                batch["_id"] = {"$gt": last}
+            cursor = coll.find(batch, {"_id": 1}).sort("_id", 1)
+            edge = next(cursor.skip(PLAN_SYNC_BATCH - 1).limit(1), None)
+            if edge:
+                batch["_id"] = {**batch.get("_id", {}), "$lte": edge["_id"]}
+            updated += coll.update_many(batch, update).modified_count
+            logger.info("Synced plan %s to %d of %d users", self.key, updated, total)
+            if not edge:
+                return updated
+            last = edge["_id"]
+
 
 class User(db.Document, UserMixin):
-    meta = {"strict": False}
+    meta = {
+        "strict": False,
+        "indexes": [
+            "stripe.customer_id",
+            "tokens.value",
+            "plan.key",
+            "email_confirmed_at",
+            {"fields": ["deleted_at"], "sparse": True},
+        ],
+        **INDEX_META,
+    }
 
     active = db.BooleanField(default=False)
     disabled = db.BooleanField(default=False)
@@ -165,8 +246,12 @@ class User(db.Document, UserMixin):
 
     subscribed = db.BooleanField(default=False)
     roles = db.ListField(db.StringField(), default=[])
+    timezone = db.StringField(default="UTC")
+    # Set when the user deletes their account. utils/teardown.py removes them
+    deleted_at = db.DateTimeField()
 
     _token_cache = None
+    _token_cache_key = None
     _update_cache_at = None
 
     def __repr__(self) -> str:
@@ -183,6 +268,12 @@ class User(db.Document, UserMixin):
             return self.email == other.email
         return False
 
+    @property
+    def at_token_limit(self) -> bool:
+        """Returns True if the user can't add another app token"""
+        limit = getattr(self.plan, "token_limit", None) or DEFAULT_TOKEN_LIMIT
+        return len([t for t in self.tokens if t.type != "dev"]) >= limit
+
     def new_token(self, dev: bool = False) -> bool:
         """Generate a new API token"""
         if self.disabled:
@@ -193,6 +284,8 @@ class User(db.Document, UserMixin):
                     return False
             token = Token.dev()
         else:
+            if self.at_token_limit:
+                return False
             token = Token.new()
         self.tokens.append(token)
         return True
@@ -223,56 +316,64 @@ class User(db.Document, UserMixin):
             if value and token.value == value:
                 self.tokens[i].refresh()
 
-    @property
-    def _should_use_cache(self) -> bool:
-        if not self._token_cache:
+    def _should_use_cache(self, key: tuple) -> bool:
+        if not self._token_cache or key != self._token_cache_key:
             return False
-        if len(self._token_cache) != len(self.tokens):
-            return False
-        return datetime.now(tz=timezone.utc) > self._update_cache_at
+        return datetime.now(tz=timezone.utc) < self._update_cache_at
 
-    def token_usage(
-        self, limit: int = 30, refresh: bool = False
-    ) -> Dict[ObjectId, dict]:
-        """Returns recent token usage counts"""
-        if not self.tokens:
-            return {}
-        if not refresh and self._should_use_cache:
-            return self._token_cache
-        target = datetime.now(tz=timezone.utc) - timedelta(days=limit)
-        data = mdb.account.token.aggregate(
-            [
-                {"$match": {"user_id": self.id, "date": {"$gte": target}}},
-                {"$project": {"_id": 0, "date": 1, "count": 1, "token_id": 1}},
-                {
-                    "$group": {
-                        "_id": "$date",
-                        "counts": {
-                            "$push": {"token_id": "$token_id", "count": "$count"}
-                        },
-                    }
-                },
-            ]
-        )
-        data = {
-            i["_id"].date(): {j["token_id"]: j["count"] for j in i["counts"]}
-            for i in data
-        }
-        days = [(target + timedelta(days=i)).date() for i in range(limit)]
+    def _usage_series(self, buckets: list, data: dict) -> dict:
+        """Split bucketed counts into per-token lists and the app token total"""
         app_tokens = {t._id: [] for t in self.tokens if t.type != "dev"}
         dev_tokens = {t._id: [] for t in self.tokens if t.type == "dev"}
-        for day in days:
-            tokens = data.get(day, {})
+        for bucket in buckets:
+            tokens = data.get(bucket, {})
             for token_id in app_tokens:
                 app_tokens[token_id].append(tokens.get(token_id, 0))
             for token_id in dev_tokens:
                 dev_tokens[token_id].append(tokens.get(token_id, 0))
-        ret = {"days": days, "app": app_tokens, "dev": dev_tokens}
+        ret = {"app": app_tokens, "dev": dev_tokens}
         ret["total"] = [sum(i) for i in zip(*app_tokens.values())]
-        self._token_cache = ret
+        return ret
+
+    def token_usage(
+        self, limit: int = 30, refresh: bool = False
+    ) -> Dict[ObjectId, dict]:
+        """Returns recent token usage counts
+
+        Days are in the user's timezone if the backend can group by it,
+        otherwise UTC. The timezone used is returned as tz
+        """
+        if not self.tokens:
+            return {}
+        store = get_store()
+        window = day_window(self.timezone if store.local_days else None, limit)
+        key = (window, tuple(t._id for t in self.tokens))
+        if not refresh and self._should_use_cache(key):
+            return self._token_cache
+        data = store.daily(self.id, window)
+        ret = {
+            "days": list(window.days),
+            "tz": window.tz,
+            **self._usage_series(window.days, data),
+        }
+        self._token_cache, self._token_cache_key = ret, key
         self._update_cache_at = datetime.now(tz=timezone.utc) + timedelta(minutes=5)
         return ret
 
+    def token_usage_hourly(self, limit: int = 48) -> Dict[ObjectId, dict]:
+        """Returns token usage counts for the most recent UTC hours
+
+        Hours are stored in UTC, so the chart converts their labels to
+        the user's timezone
+        """
+        if not self.tokens:
+            return {}
+        now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        start = now - timedelta(hours=limit - 1)
+        data = HourlyStore().window(self.id, start, now + timedelta(hours=1))
+        hours = [start + timedelta(hours=i) for i in range(limit)]
+        return {"hours": hours, **self._usage_series(hours, data)}
+
     def remove_token_by(self, value: str = None, type: str = None) -> bool:
         """Remove the first token encountered matching a value or type"""
         for i, token in enumerate(self.tokens):
@@ -281,6 +382,25 @@ class User(db.Document, UserMixin):
                 return True
         return False
 
+    def mark_deleted(self):
+        """Disable the account and its tokens and queue it for teardown
+
+        Tokens are deactivated in the same update so the API rejects them
+        before teardown runs, including any added by another request
+        """
+        self.active = False
+        self.disabled = True
+        self.deleted_at = datetime.utcnow()
+        for token in self.tokens:
+            token.active = False
+        update = {
+            "active": False,
+            "disabled": True,
+            "deleted_at": self.deleted_at,
+            "tokens.$[].active": False,
+        }
+        mdb.account.user.update_one({"_id": self.id}, {"$set": update})
+
     @classmethod
     def by_email(cls, email: str) -> "User":
         return cls.objects(email=email).first()
@@ -293,8 +413,13 @@ class User(db.Document, UserMixin):
     def created(self) -> datetime:
         return self.id.generation_time
 
+    @property
+    def version(self) -> str:
+        """Digest of the stored document for keying Checkout sessions"""
+        return hashlib.md5(BSON.encode(self.to_mongo())).hexdigest()
+
     # @property
-    # def stripe_data(self) -> Optional[stripelib.Customer]:
+    # def stripe_data(self) -> Optional["stripelib.Customer"]:
     #     with suppress(AttributeError, stripelib.error.InvalidRequestError):
     #         return stripelib.Customer.retrieve(self.stripe.customer_id)
 
@@ -307,6 +432,8 @@ class User(db.Document, UserMixin):
 
     def invoices(self, limit: int = 5) -> List[dict]:
         """Returns the user's recent invoice objects"""
+        import stripe as stripelib
+
         with suppress(AttributeError, stripelib.error.InvalidRequestError):
             return stripelib.Invoice.list(
                 customer=self.stripe.customer_id, limit=limit
@@ -315,6 +442,8 @@ class User(db.Document, UserMixin):
 
     def has_addon(self, key: str) -> bool:
         """Returns True if user has an addon in their subscription"""
+        import stripe as stripelib
+
         addon = Addon.by_key(key)
         with suppress(AttributeError, stripelib.error.InvalidRequestError):
             sub = stripelib.Subscription.retrieve(self.stripe.subscription_id)
@@ -325,7 +454,30 @@ class User(db.Document, UserMixin):
 
     def add_addon(self, key: str):
         """Adds an addon to the user's subscription"""
+        import stripe as stripelib
+
         addon = Addon.by_key(key)
-        stripelib.SubscriptionItem.create(
+        item = stripelib.SubscriptionItem.create(
             subscription=self.stripe.subscription_id, price=addon.stripe_id
         )
+        self.stripe.addon_items[key] = item.id
+
+
+def _stored_plan_key(_, document: Plan, **__):
+    """Stamp the change and remember the key so a renamed plan finds its users"""
+    document.updated = datetime.utcnow()
+    if document.id and "key" in document._changed_fields:
+        stored = Plan.objects(id=document.id).only("key").first()
+        document._stored_key = stored.key if stored else None
+
+
+def _sync_plan(_, document: Plan, created: bool = False, **__):
+    """Propagate plan edits to the copy embedded in each user"""
+    if created:
+        return
+    old_key = document.__dict__.pop("_stored_key", None)
+    document.sync_users(list(document._changed_fields), old_key)
+
+
+signals.pre_save.connect(_stored_plan_key, sender=Plan)
+signals.post_save.connect(_sync_plan, sender=Plan)
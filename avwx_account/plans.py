@@ -3,56 +3,85 @@ Stripe subscription and customer management
 """
 
 import stripe
+from flask import current_app
 from flask_user import current_user
-from avwx_account import app
+from avwx_account.cache import cached, plan_by_price
 from avwx_account.models import Plan, Stripe, User
 
-stripe.api_key = app.config["STRIPE_SECRET_KEY"]
 
-_ROOT = app.config["ROOT_URL"]
-_SESSION = {
-    "payment_method_types": ["card"],
-    "success_url": _ROOT + "/stripe/success",
-    "cancel_url": _ROOT + "/stripe/cancel",
-}
+def _session_urls() -> dict:
+    root = current_app.config["ROOT_URL"]
+    return {
+        "payment_method_types": ["card"],
+        "success_url": root + "/stripe/success",
+        "cancel_url": root + "/stripe/cancel",
+    }
 
 
-def get_session(plan: Plan) -> stripe.checkout.Session:
+def get_session(plan: Plan, idempotency_key: str = None) -> stripe.checkout.Session:
     """Creates a Stripe Session object to start a Checkout"""
     params = {
         "client_reference_id": current_user.id,
         "subscription_data": {"items": [{"plan": plan.stripe_id}]},
-        **_SESSION,
+        **_session_urls(),
     }
     if current_user.stripe:
         params["customer"] = current_user.stripe.customer_id
     else:
         params["customer_email"] = current_user.email
-    return stripe.checkout.Session.create(**params)
+    return stripe.checkout.Session.create(idempotency_key=idempotency_key, **params)
+
+
+def get_session_id(plan: Plan) -> str:
+    """Returns a Checkout Session ID for the current user and plan
+
+    Sessions are reused until they expire or the user changes
+    """
+    key = f"checkout:{current_user.id}:{plan.key}:{current_user.version}"
+    return cached(
+        key,
+        lambda: get_session(plan, idempotency_key=key).id,
+        current_app.config["CHECKOUT_SESSION_TTL"],
+    )
 
 
 def get_event(payload: dict, sig: str) -> stripe.api_resources.event.Event:
     """Validates a Stripe event to weed out hacked calls"""
     return stripe.Webhook.construct_event(
-        payload, sig, app.config["STRIPE_SIGN_SECRET"]
+        payload, sig, current_app.config["STRIPE_SIGN_SECRET"]
     )
 
 
 def new_subscription(session: dict) -> bool:
     """Create a new subscription for a validated Checkout Session"""
+    # Not cached since a stale copy would overwrite newer tokens on save
     user = User.objects(id=session["client_reference_id"]).first()
     if user is None:
         return False
+    sub = session["subscription"]
+    # Looked up once here so plan changes never need to retrieve it
+    if isinstance(sub, str):
+        sub = stripe.Subscription.retrieve(sub)
     user.stripe = Stripe(
-        customer_id=session["customer"], subscription_id=session["subscription"]
+        customer_id=session["customer"],
+        subscription_id=sub["id"],
+        subscription_item_id=sub["items"]["data"][0]["id"],
     )
     plan_id = session["display_items"][0]["plan"]["id"]
-    user.plan = Plan.by_stripe_id(plan_id).as_embedded()
+    user.plan = plan_by_price(plan_id).as_embedded()
     user.new_token(dev=True)
     user.save()
     return True
 
 
+def _subscription_item(user: User) -> str:
+    """Returns the plan item ID, looking it up once for older subscriptions"""
+    if not user.stripe.subscription_item_id:
+        sub = stripe.Subscription.retrieve(user.stripe.subscription_id)
+        user.stripe.subscription_item_id = sub["items"]["data"][0].id
+    return user.stripe.subscription_item_id
+
+
 def change_subscription(plan: Plan) -> bool:
     """Change the subscription from one plan to another"""
     if not current_user.stripe:
@@ -60,13 +89,13 @@ def change_subscription(plan: Plan) -> bool:
     sub_id = current_user.stripe.subscription_id
     if not sub_id or current_user.plan == plan:
         return False
-    sub = stripe.Subscription.retrieve(sub_id)
-    sub.modify(
+    key = f"change:{current_user.id}:{plan.key}:{current_user.version}"
+    stripe.Subscription.modify(
         sub_id,
         cancel_at_period_end=False,
-        items=[{"id": sub["items"]["data"][0].id, "plan": plan.stripe_id}],
+        items=[{"id": _subscription_item(current_user), "plan": plan.stripe_id}],
+        idempotency_key=key,
     )
-    current_user.stripe.subscription_id = sub.id
     current_user.plan = plan
     current_user.save()
     return True
@@ -76,10 +105,12 @@ def cancel_subscription() -> bool:
     """Cancel a subscription"""
     if not current_user.stripe:
         return False
-    if current_user.stripe.subscription_id:
-        sub = stripe.Subscription.retrieve(current_user.stripe.subscription_id)
-        sub.delete()
+    sub_id = current_user.stripe.subscription_id
+    if sub_id:
+        stripe.Subscription.delete(sub_id, idempotency_key=f"cancel:{sub_id}")
         current_user.stripe.subscription_id = None
+        current_user.stripe.subscription_item_id = None
+        current_user.stripe.addon_items = {}
     current_user.plan = Plan.by_key("free").as_embedded()
     current_user.remove_token_by(type="dev")
     current_user.save()
@@ -0,0 +1,147 @@
+"""
+Development profiler for per-request Mongo and HTTP call budgets
+
+Logs a summary line for every request and warns about repeated
+identical queries, which usually mean a lookup is inside a loop
+"""
+
+# stdlib
+import hashlib
+from collections import Counter
+from time import perf_counter
+from typing import Optional
+
+# library
+from bson import json_util
+from flask import Flask, Response, current_app, g, has_request_context, request
+from pymongo import monitoring
+from requests import Session
+
+# Driver housekeeping commands that aren't part of the request's work
+IGNORED_COMMANDS = {
+    "endSessions",
+    "hello",
+    "ismaster",
+    "isMaster",
+    "ping",
+    "saslContinue",
+    "saslStart",
+}
+
+
+class RequestProfile:
+    """Mongo commands and HTTP calls made during a single request"""
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.pending = {}
+        self.queries = []
+        self.calls = []
+
+    @property
+    def repeated(self) -> dict:
+        """Query keys issued more than once and their counts"""
+        counts = Counter(key for key, _ in self.queries)
+        return {key: count for key, count in counts.items() if count > 1}
+
+    def summary(self) -> str:
+        total = (perf_counter() - self.start) * 1000
+        mongo = sum(t for _, t in self.queries) * 1000
+        http = sum(t for _, t in self.calls) * 1000
+        return (
+            f"{request.method} {request.path} {total:.1f}ms | "
+            f"{len(self.queries)} queries {mongo:.1f}ms | "
+            f"{len(self.calls)} http {http:.1f}ms | "
+            f"{len(self.repeated)} repeated"
+        )
+
+
+def _profile() -> Optional[RequestProfile]:
+    if has_request_context():
+        return g.get("profile")
+    return None
+
+
+def _query_key(event: monitoring.CommandStartedEvent) -> str:
+    """Identifies a command by its type, collection, and arguments"""
+    command = event.command
+    target = command.get(event.command_name)
+    args = {
+        key: command[key]
+        for key in ("filter", "pipeline", "updates", "deletes", "q", "query")
+        if key in command
+    }
+    if "documents" in command:
+        # Inserts of different documents aren't repeats. Hashed to keep keys short
+        docs = json_util.dumps(command["documents"], sort_keys=True).encode()
+        args["documents"] = hashlib.md5(docs).hexdigest()
+    return f"{event.command_name} {target} {json_util.dumps(args, sort_keys=True)}"
+
+
+class QueryRecorder(monitoring.CommandListener):
+    """Adds each Mongo command to the current request's profile"""
+
+    def started(self, event):
+        profile = _profile()
+        if profile is None or event.command_name in IGNORED_COMMANDS:
+            return
+        profile.pending[event.request_id] = _query_key(event)
+
+    def _finish(self, event):
+        profile = _profile()
+        if profile is None:
+            return
+        key = profile.pending.pop(event.request_id, None)
+        if key:
+            profile.queries.append((key, event.duration_micros / 1e6))
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+
+def _record_send(send):
+    """Wraps requests' Session.send used by both Stripe and MailChimp"""
+
+    def wrapper(self, prepared, **kwargs):
+        start = perf_counter()
+        try:
+            return send(self, prepared, **kwargs)
+        finally:
+            profile = _profile()
+            if profile is not None:
+                key = f"{prepared.method} {prepared.url.split('?')[0]}"
+                profile.calls.append((key, perf_counter() - start))
+
+    return wrapper
+
+
+def _start_request():
+    g.profile = RequestProfile()
+
+
+def _finish_request(response: Response) -> Response:
+    profile = g.pop("profile", None)
+    if profile is None:
+        return response
+    logger = current_app.logger
+    logger.info(profile.summary())
+    for key, count in profile.repeated.items():
+        logger.warning(f"Repeated {count}x: {key}")
+    budget = current_app.config.get("PROFILER_QUERY_BUDGET")
+    if budget and len(profile.queries) > budget:
+        logger.warning(
+            f"{request.endpoint} made {len(profile.queries)} queries. Budget is {budget}"
+        )
+    response.headers["X-Query-Count"] = str(len(profile.queries))
+    return response
+
+
+def init_app(app: Flask):
+    """Install the profiler. Must run before any Mongo clients are created"""
+    monitoring.register(QueryRecorder())
+    Session.send = _record_send(Session.send)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -0,0 +1,110 @@
+"""
+Seed a disposable local account database with synthetic users and usage
+"""
+
+# stdlib
+from datetime import datetime, timedelta, timezone
+from secrets import token_urlsafe
+from typing import List
+
+# library
+from bson import ObjectId
+
+# module
+from avwx_account.extensions import mdb
+from avwx_account.indexes import build
+
+BATCH = 10_000
+
+PLANS = [
+    {
+        "key": "free",
+        "name": "Hobby",
+        "type": "free",
+        "price": 0,
+        "level": 0,
+        "limit": 4000,
+    },
+    {
+        "key": "pro",
+        "name": "Professional",
+        "type": "pro",
+        "stripe_id": "price_pro",
+        "price": 10,
+        "level": 2,
+        "limit": 50000,
+    },
+]
+
+
+def _token(type: str = "app") -> dict:
+    value = token_urlsafe(32)
+    if type == "dev":
+        value = "dev-" + value[4:]
+    name = "Development" if type == "dev" else "App"
+    return {
+        "_id": ObjectId(),
+        "name": name,
+        "type": type,
+        "value": value,
+        "active": True,
+    }
+
+
+def _insert(collection, docs: List[dict]) -> List[dict]:
+    if len(docs) >= BATCH:
+        collection.insert_many(docs, ordered=False)
+        return []
+    return docs
+
+
+def seed(users: int, usage_rows: int) -> ObjectId:
+    """Reseed the account database. Returns the heavy user's ID"""
+    if not mdb.address or mdb.address[0] not in ("localhost", "127.0.0.1"):
+        raise ValueError("Refusing to reseed a non-local database")
+    mdb.drop_database("account")
+    mdb.account.plan.insert_many([p.copy() for p in PLANS])
+    now = datetime.now(tz=timezone.utc)
+    today = datetime(now.year, now.month, now.day)
+    days = [today - timedelta(days=i) for i in range(365)]
+    active_users = max(usage_rows // len(days), 1)
+    heavy = ObjectId()
+    batch, usage = [], []
+    for i in range(users):
+        oid = heavy if i == 0 else ObjectId()
+        plan = PLANS[i % len(PLANS)]
+        tokens = [_token()]
+        if i == 0:
+            tokens += [_token(), _token("dev")]
+        user = {
+            "_id": oid,
+            "email": f"user{i}@example.com",
+            "active": True,
+            "password": "",
+            "plan": plan,
+            "tokens": tokens,
+            "roles": [],
+        }
+        # Leave some accounts unconfirmed for the cleanup job
+        if i % 20 != 1:
+            user["email_confirmed_at"] = now
+        batch.append(user)
+        batch = _insert(mdb.account.user, batch)
+        if i >= active_users:
+            continue
+        for token in tokens:
+            for day in days:
+                usage.append(
+                    {
+                        "user_id": oid,
+                        "token_id": token["_id"],
+                        "date": day,
+                        "count": i % 4000,
+                    }
+                )
+                usage = _insert(mdb.account.token, usage)
+    for collection, docs in ((mdb.account.user, batch), (mdb.account.token, usage)):
+        if docs:
+            collection.insert_many(docs, ordered=False)
+    build()
+    return heavy
@@ -0,0 +1,145 @@
+"""
+Stream a SQL table into a Mongo collection
+
+Rows are read with a server-side cursor and transformed into raw
+documents by a column map. Each batch is inserted unordered, skipping
+duplicates caught by the unique indexes, and the last primary key is checkpointed so an interrupted
+import resumes where it left off. Requires psycopg2
+"""
+
+# pylint: disable=import-outside-toplevel
+
+# stdlib
+from collections import Counter
+from time import perf_counter
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Union
+
+# library
+from pymongo.errors import BulkWriteError
+
+if TYPE_CHECKING:
+    from psycopg2.extensions import connection
+
+# module
+from avwx_account.extensions import mdb
+from avwx_account.indexes import ensure_unique
+
+# Target field paths to a column name, column index, or function of the row
+ColumnMap = Dict[str, Union[str, int, Callable]]
+
+DUPLICATE_KEY = 11000
+
+
+def _get(row: tuple, names: Dict[str, int], column: Union[str, int, Callable]):
+    if callable(column):
+        return column(row)
+    return row[names[column] if isinstance(column, str) else column]
+
+
+def transform(row: tuple, names: Dict[str, int], columns: ColumnMap) -> dict:
+    """Build a raw document from a row. Dotted fields become sub-documents
+
+    Sub-documents where every value is null are dropped
+    """
+    doc = {}
+    for field, column in columns.items():
+        *parents, key = field.split(".")
+        target = doc
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[key] = _get(row, names, column)
+    for field in list(doc):
+        value = doc[field]
+        if isinstance(value, dict) and all(v is None for v in value.values()):
+            del doc[field]
+    return doc
+
+
+def insert(collection: str, docs: List[dict]) -> Counter:
+    """Insert a batch without stopping on duplicates"""
+    try:
+        result = mdb.account[collection].insert_many(docs, ordered=False)
+        return Counter(inserted=len(result.inserted_ids))
+    except BulkWriteError as exc:
+        errors = exc.details["writeErrors"]
+        if any(e["code"] != DUPLICATE_KEY for e in errors):
+            raise
+        return Counter(inserted=exc.details["nInserted"], duplicates=len(errors))
+
+
+def run_import(
+    conn: "connection",
+    table: str,
+    collection: str,
+    columns: ColumnMap,
+    pk: str = "id",
+    batch_size: int = 5000,
+    finalize: Optional[Callable[[dict, tuple], Optional[dict]]] = None,
+) -> Counter:
+    """Stream a table into a collection. Returns row counts
+
+    finalize can adjust each document or return None to skip the row
+    """
+    from psycopg2 import sql
+
+    # Duplicates are only skipped if the unique indexes exist, including
+    # when a batch is replayed after a crash before its checkpoint
+    built = ensure_unique()
+    if built:
+        print(f"Built {built} unique indexes")
+    checkpoint = f"sql:{table}:{collection}"
+    state = mdb.account.migration.find_one({"_id": checkpoint}) or {}
+    query = sql.SQL("SELECT * FROM {table}").format(
+        table=sql.Identifier(*table.split("."))
+    )
+    params = []
+    if state.get("last_pk") is not None:
+        query += sql.SQL(" WHERE {pk} > %s").format(pk=sql.Identifier(pk))
+        params.append(state["last_pk"])
+        print(f"Resuming {table} after {pk} {state['last_pk']}")
+    query += sql.SQL(" ORDER BY {pk}").format(pk=sql.Identifier(pk))
+
+    stats = Counter()
+    start = perf_counter()
+    # Named cursors stay on the server and only send fetched rows
+    with conn.cursor(name="sql_import") as cur:
+        cur.itersize = batch_size
+        cur.execute(query, params)
+        names, key_index = None, None
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            if names is None:
+                names = {col.name: i for i, col in enumerate(cur.description)}
+                key_index = names[pk]
+            docs = []
+            for row in rows:
+                doc = transform(row, names, columns)
+                if finalize:
+                    doc = finalize(doc, row)
+                if doc is None:
+                    stats["skipped"] += 1
+                else:
+                    docs.append(doc)
+            if docs:
+                stats.update(insert(collection, docs))
+            stats["rows"] += len(rows)
+            mdb.account.migration.update_one(
+                {"_id": checkpoint},
+                {"$set": {"last_pk": rows[-1][key_index]}},
+                upsert=True,
+            )
+            rate = stats["rows"] / (perf_counter() - start)
+            print(f"{table}: {stats['rows']} rows ({rate:.0f}/s)")
+    stats["seconds"] = round(perf_counter() - start, 1)
+    return stats
+
+
+def report(table: str, stats: Counter):
+    """Print the final counts and throughput"""
+    rate = stats["rows"] / stats["seconds"] if stats["seconds"] else 0
+    print(f"\n{table} import")
+    for key in ("rows", "inserted", "duplicates", "skipped", "seconds"):
+        print(f"  {key}: {stats[key]}")
+    print(f"  rows/s: {rate:.0f}")
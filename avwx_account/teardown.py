@@ -0,0 +1,85 @@
+"""
+Account teardown after a soft delete
+
+delete_account only marks the user. utils/teardown.py runs these steps
+for marked users so Stripe, MailChimp, and large usage histories stay
+out of the request. Each step is safe to repeat if a run fails partway
+"""
+
+# stdlib
+from collections import Counter
+from typing import Iterator
+
+# library
+import stripe
+from bson import ObjectId
+
+# module
+from avwx_account import mail
+from avwx_account.extensions import mdb
+
+BATCH_SIZE = 5000
+
+# Raw usage collections and the field holding the user ID
+USAGE_COLLECTIONS = {
+    "token": "user_id",
+    "token_hourly": "user_id",
+    "overage": "user_id",
+}
+
+
+def pending(limit: int = 0) -> Iterator[dict]:
+    """Yields users waiting for teardown, oldest first"""
+    cursor = mdb.account.user.find(
+        {"deleted_at": {"$exists": True}},
+        {"email": 1, "stripe": 1, "deleted_at": 1},
+    )
+    return cursor.sort("deleted_at", 1).limit(limit)
+
+
+def cancel_stripe(user: dict) -> bool:
+    """Cancel the user's subscription if they have one"""
+    sub_id = (user.get("stripe") or {}).get("subscription_id")
+    if not sub_id:
+        return False
+    try:
+        stripe.Subscription.delete(sub_id, idempotency_key=f"cancel:{sub_id}")
+    except stripe.error.InvalidRequestError as exc:
+        # Already canceled by an earlier run or from the dashboard
+        if exc.code != "resource_missing":
+            raise
+    return True
+
+
+def delete_usage(user_id: ObjectId, batch_size: int = BATCH_SIZE) -> Counter:
+    """Delete the user's usage rows in batches. Returns rows per collection"""
+    deleted = Counter()
+    for name, field in USAGE_COLLECTIONS.items():
+        coll = mdb.account[name]
+        while True:
+            ids = [
+                doc["_id"]
+                for doc in coll.find({field: user_id}, {"_id": 1}).limit(batch_size)
+            ]
+            if not ids:
+                break
+            deleted[name] += coll.delete_many({"_id": {"$in": ids}}).deleted_count
+    # Time series collections can only delete by metaField, which drops
+    # whole buckets instead of single documents
+    if "token_usage" in mdb.account.list_collection_names():
+        result = mdb.account.token_usage.delete_many({"meta.user_id": user_id})
+        deleted["token_usage"] += result.deleted_count
+    return deleted
+
+
+def teardown(user: dict, batch_size: int = BATCH_SIZE) -> Counter:
+    """Remove a marked user and everything attached to them"""
+    done = Counter()
+    if cancel_stripe(user):
+        done["stripe"] += 1
+    mail.delete_from_mailing_list(user["email"])
+    done["mailchimp"] += 1
+    done.update(delete_usage(user["_id"], batch_size))
+    mdb.account.user.delete_one({"_id": user["_id"], "deleted_at": {"$exists": True}})
+    done["users"] += 1
+    return done
@@ -0,0 +1,75 @@
+"""
+Pre-generated token values
+
+utils/token_pool.py fills the pool with values already checked against
+existing tokens. Claiming one is a single atomic delete, so creating or
+refreshing a token doesn't need a uniqueness query
+"""
+
+# stdlib
+import logging
+from datetime import datetime
+from secrets import token_urlsafe
+from typing import Dict, Optional
+
+# library
+from pymongo.errors import BulkWriteError
+
+# module
+from avwx_account.extensions import mdb
+
+COLLECTION = "token_pool"
+TYPES = ("app", "dev")
+
+logger = logging.getLogger(__name__)
+
+
+def generate(type: str = "app") -> str:
+    """Returns a new random token value"""
+    value = token_urlsafe(32)
+    if type == "dev":
+        value = "dev-" + value[4:]
+    return value
+
+
+def claim(type: str = "app") -> Optional[str]:
+    """Removes and returns a pooled value. None if the pool is empty"""
+    doc = mdb.account[COLLECTION].find_one_and_delete({"type": type})
+    if doc is None:
+        # Every claim logs while the pool is dry, so alert on depth instead
+        logger.debug("Token pool is empty for %s tokens", type)
+        return None
+    return doc["_id"]
+
+
+def depth() -> Dict[str, int]:
+    """Returns the number of pooled values by token type"""
+    ret = dict.fromkeys(TYPES, 0)
+    rows = mdb.account[COLLECTION].aggregate(
+        [{"$group": {"_id": "$type", "count": {"$sum": 1}}}]
+    )
+    ret.update({row["_id"]: row["count"] for row in rows})
+    return ret
+
+
+def refill(type: str, target: int, batch_size: int = 1000) -> int:
+    """Top up the pool for a token type. Returns the number added"""
+    coll = mdb.account[COLLECTION]
+    added = 0
+    needed = target - coll.count_documents({"type": type})
+    while needed > 0:
+        values = {generate(type) for _ in range(min(needed, batch_size))}
+        used = mdb.account.user.find(
+            {"tokens.value": {"$in": list(values)}}, {"tokens.value": 1}
+        )
+        for user in used:
+            values -= {token["value"] for token in user["tokens"]}
+        now = datetime.utcnow()
+        docs = [{"_id": value, "type": type, "created": now} for value in values]
+        try:
+            count = len(coll.insert_many(docs, ordered=False).inserted_ids)
+        except BulkWriteError as exc:
+            count = exc.details["nInserted"]
+        added += count
+        needed -= count
+    return added
@@ -0,0 +1,335 @@
+"""
+Token usage storage backends
+
+The API writes usage counts. The portal only reads them for charts
+and summaries, so each backend returns the same daily shape. Recent
+hourly counts are kept separately in a compact per-token array
+"""
+
+# stdlib
+from abc import ABC, abstractmethod
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from os import environ
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from zoneinfo import ZoneInfo, available_timezones
+
+# library
+from bson import ObjectId
+from pymongo import UpdateOne
+from flask import current_app, has_app_context
+
+# module
+from avwx_account.extensions import mdb
+
+DailyCounts = Dict[date, Dict[ObjectId, int]]
+HourlyCounts = Dict[datetime, Dict[ObjectId, int]]
+
+
+class Window(NamedTuple):
+    """Local days in a usage window and the UTC instant the first one starts"""
+
+    tz: str
+    start: datetime
+    days: Tuple[date, ...]
+
+
+@lru_cache(maxsize=None)
+def timezones() -> frozenset:
+    """Returns the IANA timezone names users can choose from"""
+    return frozenset(available_timezones())
+
+
+@lru_cache(maxsize=1024)
+def _window(tz: str, today: date, limit: int) -> Window:
+    first = today - timedelta(days=limit - 1)
+    start = datetime.combine(first, time(), tzinfo=ZoneInfo(tz))
+    days = tuple(first + timedelta(days=i) for i in range(limit))
+    return Window(tz, start.astimezone(timezone.utc), days)
+
+
+def day_window(tz: Optional[str], limit: int) -> Window:
+    """Returns the window of days ending today in a timezone
+
+    Boundaries only change at local midnight, so they are cached per day
+    """
+    tz = tz or "UTC"
+    return _window(tz, datetime.now(ZoneInfo(tz)).date(), limit)
+
+
+class UsageStore(ABC):
+    """Reads per-token usage counts for a user"""
+
+    collection: str
+    # Whether daily counts can be grouped by the window's timezone
+    local_days: bool = False
+
+    @property
+    def _coll(self):
+        return mdb.account[self.collection]
+
+    @abstractmethod
+    def daily(self, user_id: ObjectId, window: Window) -> DailyCounts:
+        """Returns token counts for each day in the window"""
+
+    @abstractmethod
+    def reconcile(self, totals: List[dict]):
+        """Make sure each daily total is recorded
+
+        Totals have user_id, token_id, date, and count. Existing counts are
+        only ever raised so compaction can't undercount a day
+        """
+
+    @staticmethod
+    def _reshape(rows: Iterable[dict], zone: Optional[ZoneInfo] = None) -> DailyCounts:
+        ret = {}
+        for row in rows:
+            day = row["_id"]["date"]
+            if zone:
+                # Local midnight comes back as a naive UTC datetime
+                day = day.replace(tzinfo=timezone.utc).astimezone(zone)
+            day = day.date()
+            ret.setdefault(day, {})[row["_id"]["token_id"]] = row["count"]
+        return ret
+
+
+class DailyStore(UsageStore):
+    """One document per user, token, and UTC day in account.token"""
+
+    collection = "token"
+
+    def daily(self, user_id: ObjectId, window: Window) -> DailyCounts:
+        # Rows are already day buckets, so the window selects them by date
+        start = datetime.combine(window.days[0], time())
+        rows = self._coll.aggregate(
+            [
+                {"$match": {"user_id": user_id, "date": {"$gte": start}}},
+                {
+                    "$project": {
+                        "_id": {"date": "$date", "token_id": "$token_id"},
+                        "count": 1,
+                    }
+                },
+            ]
+        )
+        return self._reshape(rows)
+
+    def reconcile(self, totals: List[dict]):
+        if not totals:
+            return
+        ops = [
+            UpdateOne(
+                {k: row[k] for k in ("user_id", "token_id", "date")},
+                {"$max": {"count": row["count"]}},
+                upsert=True,
+            )
+            for row in totals
+        ]
+        self._coll.bulk_write(ops, ordered=False)
+
+
+class TimeSeriesStore(UsageStore):
+    """MongoDB time-series collection with user and token metadata"""
+
+    collection = "token_usage"
+    local_days = True
+    options = {
+        "timeField": "timestamp",
+        "metaField": "meta",
+        "granularity": "hours",
+    }
+
+    def create(self) -> bool:
+        """Create the time-series collection and its user index
+
+        Returns False if the collection already exists. The index is built
+        either way so reads and reconcile never scan the collection
+        """
+        created = self.collection not in mdb.account.list_collection_names()
+        if created:
+            mdb.account.create_collection(self.collection, timeseries=self.options)
+        # Matches RAW_INDEXES in models so utils/indexes.py sees it as built
+        self._coll.create_index([("meta.user_id", 1), ("timestamp", 1)])
+        return created
+
+    @staticmethod
+    def document(
+        user_id: ObjectId, token_id: ObjectId, timestamp: datetime, count: int
+    ) -> dict:
+        """Format a single measurement"""
+        return {
+            "timestamp": timestamp,
+            "meta": {"user_id": user_id, "token_id": token_id},
+            "count": count,
+        }
+
+    def insert(self, docs: List[dict]):
+        """Insert measurements created with document"""
+        self._coll.insert_many(docs, ordered=False)
+
+    def daily(self, user_id: ObjectId, window: Window) -> DailyCounts:
+        rows = self._coll.aggregate(
+            [
+                {
+                    "$match": {
+                        "meta.user_id": user_id,
+                        "timestamp": {"$gte": window.start},
+                    }
+                },
+                {
+                    "$group": {
+                        "_id": {
+                            "date": {
+                                "$dateTrunc": {
+                                    "date": "$timestamp",
+                                    "unit": "day",
+                                    "timezone": window.tz,
+                                }
+                            },
+                            "token_id": "$meta.token_id",
+                        },
+                        "count": {"$sum": "$count"},
+                    }
+                },
+            ]
+        )
+        return self._reshape(rows, ZoneInfo(window.tz))
+
+    def reconcile(self, totals: List[dict]):
+        if not totals:
+            return
+        # Measurements can't be updated in place, so insert any shortfall
+        users = list({row["user_id"] for row in totals})
+        days = [row["date"] for row in totals]
+        rows = self._coll.aggregate(
+            [
+                {
+                    "$match": {
+                        "meta.user_id": {"$in": users},
+                        "timestamp": {
+                            "$gte": min(days),
+                            "$lt": max(days) + timedelta(days=1),
+                        },
+                    }
+                },
+                {
+                    "$group": {
+                        "_id": {
+                            "user_id": "$meta.user_id",
+                            "token_id": "$meta.token_id",
+                            "date": {
+                                "$dateTrunc": {"date": "$timestamp", "unit": "day"}
+                            },
+                        },
+                        "count": {"$sum": "$count"},
+                    }
+                },
+            ]
+        )
+        current = {
+            (r["_id"]["user_id"], r["_id"]["token_id"], r["_id"]["date"]): r["count"]
+            for r in rows
+        }
+        docs = []
+        for row in totals:
+            key = (row["user_id"], row["token_id"], row["date"])
+            missing = row["count"] - current.get(key, 0)
+            if missing > 0:
+                docs.append(self.document(*key, missing))
+        if docs:
+            self.insert(docs)
+
+
+class HourlyStore:
+    """One document per user, token, and UTC day with a 24 item hours array"""
+
+    collection = "token_hourly"
+
+    @property
+    def _coll(self):
+        return mdb.account[self.collection]
+
+    @staticmethod
+    def _day(when: datetime) -> datetime:
+        return datetime(when.year, when.month, when.day)
+
+    def increment(
+        self, user_id: ObjectId, token_id: ObjectId, when: datetime, count: int = 1
+    ):
+        """Add to a token's count for the hour. This is the format the API writes"""
+        query = {"user_id": user_id, "token_id": token_id, "date": self._day(when)}
+        update = {"$inc": {f"hours.{when.hour}": count}}
+        if self._coll.update_one(query, update).matched_count:
+            return
+        # Create the zeroed array first since $inc can't create array items
+        self._coll.update_one(query, {"$setOnInsert": {"hours": [0] * 24}}, upsert=True)
+        self._coll.update_one(query, update)
+
+    def window(self, user_id: ObjectId, start: datetime, end: datetime) -> HourlyCounts:
+        """Returns token counts for each hour from start up to end"""
+        rows = self._coll.find(
+            {
+                "user_id": user_id,
+                "date": {"$gte": self._day(start), "$lte": self._day(end)},
+            },
+            {"_id": 0, "date": 1, "token_id": 1, "hours": 1},
+        )
+        start, end = start.replace(tzinfo=None), end.replace(tzinfo=None)
+        ret = {}
+        for row in rows:
+            for hour, count in enumerate(row["hours"]):
+                when = row["date"] + timedelta(hours=hour)
+                if start <= when < end:
+                    ret.setdefault(when, {})[row["token_id"]] = count
+        return ret
+
+    def expired(self, before: datetime, batch_size: int) -> Iterator[List[dict]]:
+        """Yields batches of hourly documents for days before a cutoff"""
+        cursor = self._coll.find(
+            {"date": {"$lt": self._day(before)}},
+            {"user_id": 1, "token_id": 1, "date": 1, "hours": 1},
+            batch_size=batch_size,
+        )
+        batch = []
+        for row in cursor:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def compact(
+        self, store: UsageStore, before: datetime, batch_size: int = 1000
+    ) -> int:
+        """Roll hourly counts older than the cutoff into daily totals
+
+        Returns the number of hourly documents removed
+        """
+        count = 0
+        for batch in self.expired(before, batch_size):
+            totals = [
+                {
+                    "user_id": row["user_id"],
+                    "token_id": row["token_id"],
+                    "date": row["date"],
+                    "count": sum(row["hours"]),
+                }
+                for row in batch
+            ]
+            store.reconcile(totals)
+            self._coll.delete_many({"_id": {"$in": [row["_id"] for row in batch]}})
+            count += len(batch)
+        return count
+
+
+BACKENDS = {"daily": DailyStore, "timeseries": TimeSeriesStore}
+
+
+def get_store() -> UsageStore:
+    """Returns the configured usage backend"""
+    if has_app_context():
+        name = current_app.config["USAGE_BACKEND"]
+    else:
+        name = environ.get("USAGE_BACKEND", "daily")
+    return BACKENDS[name]()
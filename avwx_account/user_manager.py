@@ -4,12 +4,13 @@ Customize flask-user management system
 
 # pylint: disable=missing-class-docstring,missing-function-docstring,attribute-defined-outside-init
 
+from flask import Flask
 from flask_login import AnonymousUserMixin
 from flask_user import UserManager
 from flask_user.forms import RegisterForm
 from flask_wtf import RecaptchaField
 
-from avwx_account import app, db
+from avwx_account.extensions import db
 from avwx_account.models import User
 
 
@@ -22,9 +23,6 @@ class CustomUserManager(UserManager):
         self.RegisterFormClass = CustomRegisterForm
 
 
-user_manager = CustomUserManager(app, db, User)
-
-
 class Anonymous(AnonymousUserMixin):
     """Say that anonymous users have no roles"""
 
@@ -33,4 +31,8 @@ class Anonymous(AnonymousUserMixin):
         return False
 
 
-user_manager.anonymous_user = Anonymous
+def init_app(app: Flask) -> CustomUserManager:
+    """Attach the user manager and its views to the app"""
+    user_manager = CustomUserManager(app, db, User)
+    user_manager.anonymous_user = Anonymous
+    return user_manager
@@ -1 +1,3 @@
 from . import account, home, payment, plan, token
+
+BLUEPRINTS = (account.bp, home.bp, payment.bp, plan.bp, token.bp)
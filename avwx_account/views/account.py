@@ -3,33 +3,34 @@ Account management views
 """
 
 # library
-from flask import flash, redirect, render_template, request, url_for
+from flask import Blueprint, flash, redirect, render_template, request, url_for
 from flask_login import logout_user
 from flask_user import login_required, current_user
 
 # app
 import avwx_account.mail as mail
-from avwx_account import app, plans
+from avwx_account.usage import timezones
 
+bp = Blueprint("account", __name__)
 
-@app.route("/delete_account", methods=["GET", "POST"])
+
+@bp.route("/delete_account", methods=["GET", "POST"])
 @login_required
 def delete_account():
     email = ""
     if request.method == "POST":
         email = request.form["email"]
         if email == current_user.email:
-            plans.cancel_subscription()
-            mail.delete_from_mailing_list(email)
-            current_user.delete()
+            # Stripe, MailChimp, and usage rows are removed by utils/teardown.py
+            current_user.mark_deleted()
             logout_user()
             flash("Your account has been deleted", "success")
-            return redirect(url_for("home"))
+            return redirect(url_for("home.home"))
         flash("Email does not match", "error")
     return render_template("delete_account.html", form_email=email)
 
 
-@app.route("/subscribe")
+@bp.route("/subscribe")
 @login_required
 def subscribe():
     if not current_user.subscribed:
@@ -40,4 +41,16 @@ def subscribe():
     else:
         msg = "You have already subscribed"
     flash(msg or "Added to the mailing list", "info")
-    return redirect(url_for("manage"))
+    return redirect(url_for("home.manage"))
+
+
+@bp.route("/timezone", methods=["POST"])
+@login_required
+def set_timezone():
+    tz = request.form.get("timezone")
+    if tz in timezones():
+        current_user.timezone = tz
+        current_user.save()
+    else:
+        flash("Unknown timezone", "error")
+    return redirect(url_for("graphs.token_usage"))
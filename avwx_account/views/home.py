@@ -5,20 +5,26 @@ App home and meta views
 # pylint: disable=missing-function-docstring
 
 # library
-from flask import render_template
+from flask import Blueprint, render_template, session
 from flask_user import login_required, current_user
 
 # app
-from avwx_account import app
+from avwx_account.assets import serve_static
+from avwx_account.cache import cached_page
 from avwx_account.plans import Plan
 
+bp = Blueprint("home", __name__)
 
-@app.route("/")
+
+@bp.route("/")
 def home():
-    return render_template("index.html", plan=getattr(current_user, "plan", None))
+    # Anonymous visitors all see the same page unless there's a flashed message
+    if current_user.is_authenticated or "_flashes" in session:
+        return render_template("index.html", plan=getattr(current_user, "plan", None))
+    return cached_page("home", lambda: render_template("index.html", plan=None))
 
 
-@app.route("/manage")
+@bp.route("/manage")
 @login_required
 def manage():
     if not current_user.plan:
@@ -31,6 +37,6 @@ def manage():
     )
 
 
-@app.route("/.well-known/apple-developer-merchantid-domain-association")
+@bp.route("/.well-known/apple-developer-merchantid-domain-association")
 def apple_pay_mid():
-    return app.send_static_file("apple-developer-merchantid-domain-association.dms")
+    return serve_static("apple-developer-merchantid-domain-association.dms")
@@ -3,88 +3,106 @@ Plan management views
 """
 
 # library
-from flask import flash, redirect, render_template, request, url_for
+from flask import (
+    Blueprint,
+    current_app,
+    flash,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
 from flask_user import login_required, current_user
 
 # app
-from avwx_account import app, plans
+from avwx_account import plans
 
+bp = Blueprint("plan", __name__)
 
-@app.route("/change/<plan>", methods=["GET", "POST"])
+
+@bp.route("/change/<plan>", methods=["GET", "POST"])
 @login_required
 def change(plan: str):
-    new_plan = plans.Plan.by_key(plan).as_embedded()
+    new_plan = plans.Plan.by_key(plan)
     if new_plan is None:
-        return redirect(url_for("manage"))
+        return redirect(url_for("home.manage"))
+    new_plan = new_plan.as_embedded()
     if current_user.plan == new_plan:
         flash(f"You are already subscribed to the {new_plan.name} plan", "info")
-        return redirect(url_for("manage"))
+        return redirect(url_for("home.manage"))
     old_plan = current_user.plan
-    session = None
     if request.method == "POST":
         msg = f"Your {new_plan.name} plan is now active"
         if new_plan.price:
             if not plans.change_subscription(new_plan):
                 flash("Unable to update your subscription", "error")
-                return redirect(url_for("manage"))
+                return redirect(url_for("home.manage"))
             msg += ". Thank you for supporting AVWX!"
         else:
             plans.cancel_subscription()
         flash(msg, "success")
-        return redirect(url_for("manage"))
-    if new_plan.price:
-        if current_user.stripe is None or not current_user.stripe.subscription_id:
-            session = plans.get_session(new_plan)
+        return redirect(url_for("home.manage"))
     return render_template(
         "change.html",
-        stripe_key=app.config["STRIPE_PUB_KEY"],
+        stripe_key=current_app.config["STRIPE_PUB_KEY"],
         old_plan=old_plan,
         new_plan=new_plan,
-        session=session,
+        checkout_url=url_for("plan.checkout", plan=new_plan.key),
     )
 
 
+@bp.route("/change/<plan>/checkout", methods=["POST"])
+@login_required
+def checkout(plan: str):
+    """Start a Checkout session once the user chooses to subscribe"""
+    new_plan = plans.Plan.by_key(plan)
+    if new_plan is None or not new_plan.price or current_user.has_subscription:
+        return jsonify(error="Unable to start checkout"), 400
+    return jsonify(id=plans.get_session_id(new_plan))
+
+
 # Disabled because Stripe Checkout can't accept a standalone metered item
-# @app.route("/plan/overage/new")
+# @bp.route("/plan/overage/new")
 # @login_required
 # def new_overage():
 #     """Enable overage for an account with no Stripe subscription"""
 #     if current_user.allow_overage:
 #         flash("Limit overage is already enabled")
-#         return redirect(url_for("manage"))
+#         return redirect(url_for("home.manage"))
 #     if current_user.has_subscription:
 #         if current_user.has_addon("overage"):
 #             flash("Limit overage is already whitelisted for your account")
-#             return redirect(url_for("manage"))
+#             return redirect(url_for("home.manage"))
 #         else:
-#             return redirect(url_for("enable_overage"))
+#             return redirect(url_for("plan.enable_overage"))
 #     return render_template(
 #         "first_addon.html",
-#         stripe_key=app.config["STRIPE_PUB_KEY"],
-#         session = plans.get_session(Addon.by_key("overage")),
+#         stripe_key=current_app.config["STRIPE_PUB_KEY"],
+#         checkout_url=url_for("plan.checkout", plan="overage"),
 #     )
 
 
-@app.route("/plan/overage/enable")
+@bp.route("/plan/overage/enable")
 @login_required
 def enable_overage():
     """Enable overage for a subscribed account"""
     if current_user.allow_overage:
         flash("Limit overage is already enabled")
-        return redirect(url_for("manage"))
+        return redirect(url_for("home.manage"))
     if not current_user.has_addon("overage"):
         if not current_user.has_subscription:
-            # return redirect(url_for("new_overage"))
+            # return redirect(url_for("plan.new_overage"))
             flash("Limit overage currently requires a paid account")
-            return redirect(url_for("manage"))
+            return redirect(url_for("home.manage"))
         current_user.add_addon("overage")
     current_user.allow_overage = True
     current_user.save()
     flash("Limit overage has been enabled")
-    return redirect(url_for("manage"))
+    return redirect(url_for("home.manage"))
 
 
-@app.route("/plan/overage/disable")
+@bp.route("/plan/overage/disable")
 @login_required
 def disable_overage():
     """Disable overage by flipping boolean"""
@@ -94,4 +112,4 @@ def disable_overage():
         flash("Limit overage has been disabled")
     else:
         flash("Limit overage is already disabled")
-    return redirect(url_for("manage"))
+    return redirect(url_for("home.manage"))
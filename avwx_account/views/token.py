@@ -3,30 +3,35 @@ Token management views
 """
 
 # library
-from flask import flash, redirect, render_template, request, url_for
+from flask import Blueprint, flash, redirect, render_template, request, url_for
 from flask_user import login_required, current_user
 
 # app
-from avwx_account import app
+from avwx_account.limiter import limit
 
+bp = Blueprint("token", __name__)
 
-@app.route("/token/new")
+
+@bp.route("/token/new")
 @login_required
+@limit("token")
 def new_token():
-    if current_user.new_token():
+    if current_user.at_token_limit:
+        flash("You've reached the token limit for your plan", "error")
+    elif current_user.new_token():
         current_user.save()
     else:
         flash("Your account has been disabled. Contact avwx@dupont.dev", "error")
-    return redirect(url_for("manage"))
+    return redirect(url_for("home.manage"))
 
 
-@app.route("/token/edit", methods=["GET", "POST"])
+@bp.route("/token/edit", methods=["GET", "POST"])
 @login_required
 def edit_token():
     token = current_user.get_token(request.args.get("value"))
     if token is None:
         flash("Token not found in your account", "error")
-        return redirect(url_for("manage"))
+        return redirect(url_for("home.manage"))
     if request.method == "POST":
         if current_user.update_token(
             token.value,
@@ -34,25 +39,27 @@ def edit_token():
             active=bool(request.form.get("active")),
         ):
             current_user.save()
-            return redirect(url_for("manage"))
+            return redirect(url_for("home.manage"))
         flash("Your token was not able to be updated", "error")
     return render_template("edit_token.html", token=token)
 
 
-@app.route("/token/refresh")
+@bp.route("/token/refresh")
 @login_required
+@limit("token")
 def refresh_token():
     token = current_user.get_token(request.args.get("value"))
     if token is None:
         flash("Token not found in your account", "error")
-        return redirect(url_for("manage"))
+        return redirect(url_for("home.manage"))
     current_user.refresh_token(token.value)
     current_user.save()
-    return redirect(url_for("manage"))
+    return redirect(url_for("home.manage"))
 
 
-@app.route("/token/delete")
+@bp.route("/token/delete")
 @login_required
+@limit("token")
 def delete_token():
     token = current_user.get_token(request.args.get("value"))
     if token is None:
@@ -62,4 +69,4 @@ def delete_token():
     else:
         current_user.remove_token_by(value=token.value)
         current_user.save()
-    return redirect(url_for("manage"))
+    return redirect(url_for("home.manage"))
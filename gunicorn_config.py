@@ -1,9 +1,72 @@
 """
 Gunicorn application server settings
+
+Sizes come from the environment when set, otherwise from the CPU count.
+Use utils/loadtest.py to check changes. Heroku sets WEB_CONCURRENCY
+from the dyno's memory, which is more accurate than its CPU count
+
+    WEB_CONCURRENCY     Worker processes
+    GUNICORN_THREADS    Threads per worker
+    GUNICORN_TIMEOUT    Seconds before a silent worker is restarted
+    GUNICORN_PRELOAD    Load the app before forking. Defaults to true
 """
 
+from multiprocessing import cpu_count
+from os import environ
+
+
+def _int(key: str, default: int) -> int:
+    return int(environ.get(key) or default)
+
+
+def _metrics_enabled() -> bool:
+    return environ.get("METRICS_ENABLED", "").lower() in ("1", "true", "yes")
+
+
 # bind = '0.0.0.0:8000'
 
-workers = 4
+# Requests mostly wait on Mongo and Stripe, so threads go further than
+# more processes. Threads above 1 switch to the gthread worker
+workers = _int("WEB_CONCURRENCY", cpu_count() + 1)
+threads = _int("GUNICORN_THREADS", 4)
+
+# Heroku's router gives up after 30 seconds
+timeout = _int("GUNICORN_TIMEOUT", 30)
+graceful_timeout = 30
+keepalive = 5
 
+# Spread restarts so workers don't all recycle at once
 max_requests = 1000
+max_requests_jitter = 100
+
+# Workers share the imported app pages until they write to them
+preload_app = environ.get("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+
+def _worker_event(event: str):
+    if _metrics_enabled():
+        from avwx_account.metrics import WORKER_EVENTS
+
+        WORKER_EVENTS.labels(event).inc()
+
+
+def post_fork(server, worker):
+    """Drop Mongo clients copied from the master when the app is preloaded"""
+    from avwx_account.extensions import reset_clients
+
+    reset_clients()
+    _worker_event("start")
+
+
+def worker_abort(worker):
+    """Count workers killed for hitting the timeout"""
+    _worker_event("timeout")
+
+
+def child_exit(server, worker):
+    """Remove an exited worker's metrics from the multiprocess directory"""
+    if environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
+    _worker_event("exit")
@@ -1 +1,3 @@
-from avwx_account import app
+from avwx_account import create_app
+
+app = create_app()
@@ -0,0 +1,248 @@
+"""
+Find and repair drift between users, plans, Stripe, and usage rows
+
+Checks:
+    stale plan      Embedded plan differs from the catalog
+    stripe plan     Subscription price doesn't match the embedded plan
+    no subscription Stored subscription is missing or canceled in Stripe
+    dev token       Paid user without a dev token
+    orphaned usage  Usage rows for users that no longer exist
+    orphaned token  Usage rows for tokens no longer on the user
+
+Users are streamed once and compared in memory against the plan catalog
+and, with --use-stripe, every subscription loaded up front. Repairs are
+only sent with --apply, as unordered bulk writes
+Run from the project root with PYTHONPATH=.
+"""
+
+# stdlib
+from collections import Counter
+from datetime import datetime
+from os import environ
+from typing import Dict, List, Optional, Set
+
+# library
+import begin
+import stripe
+from dotenv import load_dotenv
+from bson import ObjectId
+from pymongo import DeleteMany, UpdateOne
+
+load_dotenv()
+
+# module
+from avwx_account import mdb
+from avwx_account.models import PlanEmbedded, Token
+
+BATCH_SIZE = 1000
+
+EMBEDDED_FIELDS = [f for f in PlanEmbedded._fields if f not in ("id", "_cls")]
+
+
+def plan_catalog() -> Dict[str, dict]:
+    """Returns the expected embedded plan keyed by plan key"""
+    return {
+        plan["key"]: {k: plan[k] for k in EMBEDDED_FIELDS if k in plan}
+        for plan in mdb.account.plan.find({}, {"_id": 0})
+    }
+
+
+def stripe_mirror() -> Dict[str, dict]:
+    """Returns every subscription's status and price IDs keyed by ID"""
+    ret = {}
+    for sub in stripe.Subscription.list(status="all", limit=100).auto_paging_iter():
+        ret[sub["id"]] = {
+            "status": sub["status"],
+            "prices": [item["price"]["id"] for item in sub["items"]["data"]],
+        }
+    print(f"Loaded {len(ret)} Stripe subscriptions")
+    return ret
+
+
+class Auditor:
+    """Collects findings and repair operations while streaming users"""
+
+    def __init__(self, apply: bool, mirror: Optional[Dict[str, dict]] = None):
+        self.apply = apply
+        self.catalog = plan_catalog()
+        self.by_price = {
+            p["stripe_id"]: p for p in self.catalog.values() if p.get("stripe_id")
+        }
+        self.mirror = mirror
+        self.found = Counter()
+        self.user_ids = set()
+        self._ops: List[UpdateOne] = []
+        # Token IDs for the users waiting on a token usage check
+        self._tokens: Dict[ObjectId, Set[ObjectId]] = {}
+
+    def _report(self, check: str, user: dict, detail: str = ""):
+        self.found[check] += 1
+        if self.found[check] <= 5:
+            print(f"{check}: {user.get('email')} {detail}")
+
+    def _repair(self, user: dict, update: dict):
+        self._ops.append(UpdateOne({"_id": user["_id"]}, update))
+        if len(self._ops) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Send pending user repairs and check pending token usage"""
+        if self.apply and self._ops:
+            mdb.account.user.bulk_write(self._ops, ordered=False)
+        self._ops = []
+        if self._tokens:
+            self.check_tokens()
+
+    def check_plan(self, user: dict) -> Optional[dict]:
+        """Returns the expected embedded plan if the stored one is stale"""
+        plan = user.get("plan") or {}
+        expected = self.catalog.get(plan.get("key"))
+        if expected and any(plan.get(k) != v for k, v in expected.items()):
+            self._report("stale plan", user, plan.get("key"))
+            return expected
+        return None
+
+    def check_stripe(self, user: dict) -> Optional[dict]:
+        """Returns the plan matching the user's subscription if it differs"""
+        sub_id = (user.get("stripe") or {}).get("subscription_id")
+        if self.mirror is None or not sub_id:
+            return None
+        sub = self.mirror.get(sub_id)
+        if not sub or sub["status"] in ("canceled", "incomplete_expired"):
+            # Needs a person to decide between resubscribing and downgrading
+            self._report("no subscription", user, sub_id)
+            return None
+        plan = user.get("plan") or {}
+        if plan.get("stripe_id") in sub["prices"]:
+            return None
+        for price in sub["prices"]:
+            if price in self.by_price:
+                self._report("stripe plan", user, f"{plan.get('key')} -> {price}")
+                return self.by_price[price]
+        return None
+
+    def check_user(self, user: dict):
+        """Queue repairs for a single user"""
+        self.user_ids.add(user["_id"])
+        update = {}
+        plan = self.check_stripe(user) or self.check_plan(user)
+        if plan:
+            update["$set"] = {"plan": plan}
+        plan = plan or user.get("plan") or {}
+        paid = plan.get("type") not in (None, "free")
+        tokens = user.get("tokens") or []
+        if paid and not any(t.get("type") == "dev" for t in tokens):
+            self._report("dev token", user)
+            # Building a token claims a pooled value, so skip it for reports
+            if self.apply:
+                update["$push"] = {"tokens": Token.dev().to_mongo().to_dict()}
+        if update:
+            self._repair(user, update)
+        self._tokens[user["_id"]] = {t["_id"] for t in tokens if "_id" in t}
+        if len(self._tokens) >= BATCH_SIZE:
+            self.check_tokens()
+
+    def check_tokens(self) -> int:
+        """Find and optionally delete usage rows for removed tokens"""
+        rows = mdb.account.token.aggregate(
+            [
+                {
+                    "$match": {
+                        "user_id": {"$in": list(self._tokens)},
+                        "token_id": {"$ne": None},
+                    }
+                },
+                {
+                    "$group": {
+                        "_id": {"user_id": "$user_id", "token_id": "$token_id"},
+                        "count": {"$sum": 1},
+                    }
+                },
+            ]
+        )
+        orphaned = {
+            (r["_id"]["user_id"], r["_id"]["token_id"]): r["count"]
+            for r in rows
+            if r["_id"]["token_id"] not in self._tokens[r["_id"]["user_id"]]
+        }
+        self._tokens = {}
+        if not orphaned:
+            return 0
+        # Tokens created since the batch was read aren't orphaned
+        users = mdb.account.user.find(
+            {"_id": {"$in": list({user_id for user_id, _ in orphaned})}},
+            {"tokens._id": 1},
+        )
+        for user in users:
+            for token in user.get("tokens", []):
+                orphaned.pop((user["_id"], token.get("_id")), None)
+        count = sum(orphaned.values())
+        self.found["orphaned token"] += count
+        ops = [
+            DeleteMany({"user_id": user_id, "token_id": token_id})
+            for user_id, token_id in orphaned
+        ]
+        if self.apply and ops:
+            mdb.account.token.bulk_write(ops, ordered=False)
+        return count
+
+    def check_usage(self) -> int:
+        """Find and optionally delete usage rows for missing users"""
+        rows = mdb.account.token.aggregate(
+            [{"$group": {"_id": "$user_id", "count": {"$sum": 1}}}],
+            allowDiskUse=True,
+        )
+        orphaned = {r["_id"]: r["count"] for r in rows if r["_id"] not in self.user_ids}
+        # Users who signed up after the scan passed them aren't orphaned
+        candidates = list(orphaned)
+        for i in range(0, len(candidates), BATCH_SIZE):
+            ids = candidates[i : i + BATCH_SIZE]
+            for user in mdb.account.user.find({"_id": {"$in": ids}}, {"_id": 1}):
+                orphaned.pop(user["_id"])
+        count = sum(orphaned.values())
+        self.found["orphaned usage"] = count
+        ids = list(orphaned)
+        ops = [
+            DeleteMany({"user_id": {"$in": ids[i : i + BATCH_SIZE]}})
+            for i in range(0, len(ids), BATCH_SIZE)
+        ]
+        if self.apply and ops:
+            mdb.account.token.bulk_write(ops, ordered=False)
+        return count
+
+
+def run(auditor: Auditor) -> Counter:
+    """Stream every user through the auditor then check usage rows"""
+    cursor = mdb.account.user.find(
+        {},
+        {"email": 1, "plan": 1, "stripe": 1, "tokens._id": 1, "tokens.type": 1},
+        batch_size=BATCH_SIZE,
+    )
+    for i, user in enumerate(cursor, start=1):
+        auditor.check_user(user)
+        if i % 50_000 == 0:
+            print(f"{i} users checked")
+    auditor.flush()
+    auditor.check_usage()
+    return auditor.found
+
+
+@begin.start
+def main(
+    apply: "Send the repairs" = False,
+    use_stripe: "Compare against Stripe subscriptions" = False,
+) -> int:
+    """Find and repair drift between users, plans, Stripe, and usage rows"""
+    start = datetime.utcnow()
+    mirror = None
+    if use_stripe:
+        stripe.api_key = environ.get("STRIPE_SECRET_KEY")
+        mirror = stripe_mirror()
+    auditor = Auditor(apply, mirror)
+    found = run(auditor)
+    print(f"\nAudit {'repairs' if apply else 'findings'}")
+    for check, count in sorted(found.items()):
+        print(f"  {check}: {count}")
+    print(f"  users: {len(auditor.user_ids)}")
+    print(f"  seconds: {(datetime.utcnow() - start).total_seconds():.1f}")
+    return 0
@@ -0,0 +1,277 @@
+"""
+Benchmark the portal's hot paths against a seeded local Mongo
+
+Run from the project root with PYTHONPATH=. The target database is
+dropped and reseeded, so MONGO_URI must point to a disposable local mongod
+"""
+
+# stdlib
+import io
+import json
+import platform
+import subprocess
+import sys
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from importlib.util import module_from_spec, spec_from_file_location
+from os import environ, path
+from statistics import mean, median
+from time import perf_counter
+from types import ModuleType
+from typing import Callable, Dict, Optional
+from unittest.mock import patch
+
+# library
+import begin
+from bson import ObjectId
+from dotenv import load_dotenv
+from flask import Flask
+from flask_login import login_user
+
+load_dotenv()
+
+# module
+from avwx_account import create_app, graphs, mdb
+from avwx_account.models import Token, User
+from avwx_account.seed import seed
+
+UTILS = path.dirname(path.realpath(__file__))
+
+# External calls made anywhere on the benchmarked paths
+STUBS = {
+    "stripe.Invoice.list": {"data": []},
+    "stripe.Subscription.retrieve": {
+        "id": "sub_bench",
+        "items": {"data": [{"id": "si_bench"}]},
+    },
+    "stripe.checkout.Session.create": {"id": "cs_bench"},
+    "mailchimp3.entities.listmembers.ListMembers.create": {},
+}
+
+
+def _load_util(name: str) -> ModuleType:
+    """Import a script from the utils folder"""
+    spec = spec_from_file_location(name, path.join(UTILS, f"{name}.py"))
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(func: Callable, repeat: int) -> dict:
+    """Returns timing stats in milliseconds for repeated calls"""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        times.append((perf_counter() - start) * 1000)
+    times.sort()
+    return {
+        "repeat": repeat,
+        "min": times[0],
+        "mean": mean(times),
+        "median": median(times),
+        "p95": times[int(0.95 * (len(times) - 1))],
+    }
+
+
+def _job(name: str) -> Callable:
+    def run():
+        with redirect_stdout(io.StringIO()):
+            _load_util(name).main()
+
+    return run
+
+
+def _import_time(module: str) -> float:
+    """Returns the cumulative import time of a module in milliseconds"""
+    cmd = (sys.executable, "-X", "importtime", "-c", f"import {module}")
+    proc = subprocess.run(cmd, cwd=path.dirname(UTILS), capture_output=True, text=True)
+    for line in proc.stderr.splitlines():
+        parts = [p.strip() for p in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1000
+    raise ValueError(f"No import time found for {module}")
+
+
+def _startup_time() -> float:
+    """Returns the time to import and build the app in a new process"""
+    code = (
+        "from time import perf_counter; start = perf_counter(); "
+        "from avwx_account import create_app; create_app(); "
+        "print((perf_counter() - start) * 1000)"
+    )
+    cmd = (sys.executable, "-c", code)
+    proc = subprocess.run(cmd, cwd=path.dirname(UTILS), capture_output=True, text=True)
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+def startup_benchmarks(repeat: int = 5) -> Dict[str, dict]:
+    """Time importing the models and app startup in fresh interpreters"""
+
+    def collect(func: Callable) -> dict:
+        times = sorted(func() for _ in range(repeat))
+        return {"repeat": repeat, "min": times[0], "median": median(times)}
+
+    return {
+        "import avwx_account.models": collect(
+            lambda: _import_time("avwx_account.models")
+        ),
+        "create_app": collect(_startup_time),
+    }
+
+
+def run_benchmarks(app: Flask, user_id: ObjectId, repeat: int) -> dict:
+    """Time each hot path against the seeded data"""
+    user = User.objects(id=user_id).first()
+    client = app.test_client()
+    with app.test_request_context():
+        session_id = user.get_id()
+    with client.session_transaction() as session:
+        session["_user_id"] = session_id
+        session["_fresh"] = True
+    cases = {
+        "User.token_usage": (lambda: user.token_usage(refresh=True), repeat),
+        "Token.new": (Token.new, repeat),
+        "GET /token/usage": (lambda: client.get("/token/usage"), repeat),
+        "GET /manage": (lambda: client.get("/manage"), repeat),
+        "GET /": (lambda: client.get("/"), repeat),
+    }
+    for job in ("clean_unverified", "update_token_usage", "update_mc_list"):
+        cases[f"utils/{job}"] = (_job(job), 1)
+    results = {}
+    for name, (func, count) in cases.items():
+        print(f"Running {name}")
+        results[name] = measure(func, count)
+    return results
+
+
+CHART_COLORS = ("red", "orange", "yellow", "green", "blue", "purple", "pink")
+
+
+def _legacy_chart(counts: dict, key: str) -> bytes:
+    """The inline labels and chart.js datasets the usage page used to embed"""
+    labels = [d.strftime("%b %d") for d in counts[key]]
+    data = [
+        {
+            "label": "Total",
+            "data": counts["total"],
+            "borderColor": "black",
+            "borderWidth": 2,
+            "fill": False,
+            "borderDash": [5, 5],
+        }
+    ]
+    for i, values in enumerate(counts["app"].values()):
+        data.append(
+            {
+                "label": "Token",
+                "data": values,
+                "borderColor": CHART_COLORS[i % len(CHART_COLORS)],
+                "borderWidth": 2,
+                "fill": False,
+            }
+        )
+    return (json.dumps(labels) + json.dumps(data)).encode()
+
+
+def payload_benchmarks(app: Flask, user: User, repeat: int) -> Dict[str, dict]:
+    """Compare chart payload sizes and encode times"""
+    results = {}
+    windows = {
+        "30d": lambda: user.token_usage(limit=30, refresh=True),
+        "365d": lambda: user.token_usage(limit=365, refresh=True),
+        "48h": user.token_usage_hourly,
+    }
+    with app.test_request_context():
+        login_user(user)
+        for window, load in windows.items():
+            counts = load()
+            key = "hours" if "hours" in counts else "days"
+            patcher = patch.object(
+                User, "token_usage" if key == "days" else "token_usage_hourly"
+            )
+            with patcher as method:
+                method.return_value = counts
+                payload = graphs.usage_payload("app", None, key == "hours")
+            encoders = {
+                "inline json": lambda: _legacy_chart(counts, key),
+                "compact json": lambda: graphs.encode(payload)[0],
+            }
+            if graphs.msgpack:
+                encoders["compact msgpack"] = lambda: graphs.encode(payload, "msgpack")[
+                    0
+                ]
+            for name, encoder in encoders.items():
+                stats = measure(encoder, repeat)
+                stats["bytes"] = len(encoder())
+                results[f"chart {window} {name}"] = stats
+                print(f"chart {window} {name}: {stats['bytes']} bytes")
+    return results
+
+
+def _version() -> Optional[str]:
+    try:
+        cmd = ("git", "rev-parse", "--short", "HEAD")
+        return subprocess.check_output(cmd, cwd=UTILS, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, current: dict):
+    """Print the median change for each benchmark in both result sets"""
+    for name, stats in current["results"].items():
+        old = baseline["results"].get(name)
+        if not old:
+            continue
+        ratio = stats["median"] / old["median"]
+        print(
+            f"{name}: {old['median']:.2f}ms -> {stats['median']:.2f}ms ({ratio:.2f}x)"
+        )
+        if "bytes" in stats and "bytes" in old:
+            print(f"{name}: {old['bytes']} -> {stats['bytes']} bytes")
+
+
+@begin.start
+def main(
+    output: "Results JSON path" = "bench.json",
+    baseline: "Previous results JSON to compare against" = "",
+    users: "Seeded user count" = 200_000,
+    usage_rows: "Seeded account.token row count" = 2_000_000,
+    repeat: "Runs per request path" = 20,
+    skip_seed: "Reuse the existing seeded data" = False,
+) -> int:
+    """Benchmark the portal's hot paths"""
+    app = create_app()
+    if skip_seed:
+        user_id = mdb.account.user.find_one({"email": "user0@example.com"})["_id"]
+    else:
+        print("Seeding database")
+        user_id = seed(int(users), int(usage_rows))
+    for key in ("MC_KEY", "MC_USERNAME", "MC_LIST_ID"):
+        environ.setdefault(key, app.config[key])
+    mocks = [patch(target, return_value=value) for target, value in STUBS.items()]
+    for mock in mocks:
+        mock.start()
+    try:
+        results = run_benchmarks(app, user_id, int(repeat))
+        user = User.objects(id=user_id).first()
+        results.update(payload_benchmarks(app, user, int(repeat)))
+    finally:
+        for mock in mocks:
+            mock.stop()
+    print("Running startup")
+    results.update(startup_benchmarks())
+    data = {
+        "version": _version(),
+        "python": platform.python_version(),
+        "created": datetime.now(tz=timezone.utc).isoformat(),
+        "seed": {"users": int(users), "usage_rows": int(usage_rows)},
+        "results": results,
+    }
+    with open(output, "w") as fout:
+        json.dump(data, fout, indent=2)
+    print(f"Saved results to {output}")
+    if baseline:
+        with open(baseline) as fin:
+            compare(json.load(fin), data)
+    return 0
@@ -0,0 +1,67 @@
+"""
+Fingerprint and precompress static CSS and JS assets
+
+Writes builds with gzip and brotli variants and a manifest to
+avwx_account/static/dist
+"""
+
+# stdlib
+import gzip
+import hashlib
+import json
+import shutil
+from os import makedirs, path, walk
+
+# library
+import brotli
+
+ROOT = path.dirname(path.dirname(path.realpath(__file__)))
+STATIC = path.join(ROOT, "avwx_account", "static")
+DIST = path.join(STATIC, "dist")
+EXTENSIONS = (".css", ".js")
+
+
+def sources() -> list:
+    """Returns asset paths relative to the static folder"""
+    ret = []
+    for folder, dirs, files in walk(STATIC):
+        if folder == STATIC and "dist" in dirs:
+            dirs.remove("dist")
+        for name in files:
+            if name.endswith(EXTENSIONS):
+                ret.append(path.relpath(path.join(folder, name), STATIC))
+    return sorted(ret)
+
+
+def build(source: str) -> str:
+    """Write the fingerprinted and compressed copies of an asset"""
+    with open(path.join(STATIC, source), "rb") as fin:
+        data = fin.read()
+    digest = hashlib.md5(data).hexdigest()[:10]
+    stem, ext = path.splitext(source)
+    target = path.join("dist", f"{stem}.{digest}{ext}")
+    out = path.join(STATIC, target)
+    makedirs(path.dirname(out), exist_ok=True)
+    shutil.copyfile(path.join(STATIC, source), out)
+    with open(out + ".gz", "wb") as fout:
+        fout.write(gzip.compress(data, compresslevel=9, mtime=0))
+    with open(out + ".br", "wb") as fout:
+        fout.write(brotli.compress(data, quality=11))
+    return target.replace(path.sep, "/")
+
+
+def main() -> int:
+    """Fingerprint and precompress static CSS and JS assets"""
+    shutil.rmtree(DIST, ignore_errors=True)
+    manifest = {}
+    for source in sources():
+        manifest[source.replace(path.sep, "/")] = build(source)
+        print(source, "->", manifest[source])
+    makedirs(DIST, exist_ok=True)
+    with open(path.join(DIST, "manifest.json"), "w") as fout:
+        json.dump(manifest, fout, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+Apply an admin operation to many accounts at once
+
+Targets are emails, Stripe customer IDs, or plan keys given as arguments
+or one per line in a file. Database changes are sent with bulk_write and
+Stripe changes run concurrently under a request rate limit
+
+Operations:
+    plan            Set the plan to --value. Add --stripe-changes to update subscriptions.
+                    Moving subscribers to a plan without a price cancels them and
+                    requires --stripe-changes
+    verify          Mark the email as confirmed
+    disable         Disable the account
+    enable          Re-enable the account
+    revoke          Deactivate every token
+    overage-on      Allow overage. Adds the Stripe addon if missing
+    overage-off     Disallow overage
+
+Run from the project root with PYTHONPATH=.
+"""
+
+# stdlib
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os import environ
+from typing import Callable, Dict, Iterator, List, Optional
+
+# library
+import begin
+import stripe
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+load_dotenv()
+
+# module
+from avwx_account import mdb
+from avwx_account.limiter import RateLimiter
+
+TARGETS = {"email": "email", "customer": "stripe.customer_id", "plan": "plan.key"}
+
+PROJECTION = {
+    "email": 1,
+    "disabled": 1,
+    "email_confirmed_at": 1,
+    "plan.key": 1,
+    "stripe": 1,
+    "tokens.active": 1,
+    "allow_overage": 1,
+}
+
+BATCH_SIZE = 1000
+
+
+def load_targets(targets: List[str], file: Optional[str]) -> List[str]:
+    """Returns targets from the command line and an optional file"""
+    ret = list(targets)
+    if file:
+        with open(file) as fin:
+            ret += [line.strip() for line in fin if line.strip()]
+    return list(dict.fromkeys(ret))
+
+
+def find_users(by: str, targets: List[str], query: Optional[str]) -> Iterator[dict]:
+    """Streams the users matching the targets and a raw JSON filter"""
+    match = json.loads(query) if query else {}
+    if targets:
+        match[TARGETS[by]] = {"$in": targets}
+    if not match:
+        raise ValueError("No targets or query given")
+    return mdb.account.user.find(match, PROJECTION, batch_size=BATCH_SIZE)
+
+
+def _set(fields: dict) -> dict:
+    return {"$set": fields}
+
+
+def _subscription(user: dict) -> Optional[str]:
+    return (user.get("stripe") or {}).get("subscription_id")
+
+
+def stripe_change_plan(user: dict, plan: dict):
+    """Move the subscription's plan item to a new price"""
+    sub_id = _subscription(user)
+    item_id = user["stripe"].get("subscription_item_id")
+    if not item_id:
+        item_id = stripe.Subscription.retrieve(sub_id)["items"]["data"][0]["id"]
+    stripe.Subscription.modify(
+        sub_id,
+        cancel_at_period_end=False,
+        items=[{"id": item_id, "price": plan["stripe_id"]}],
+    )
+
+
+def stripe_cancel(user: dict):
+    """Cancel the subscription like plans.cancel_subscription"""
+    sub_id = _subscription(user)
+    stripe.Subscription.delete(sub_id, idempotency_key=f"cancel:{sub_id}")
+
+
+def stripe_add_overage(user: dict, addon: dict) -> Dict[str, str]:
+    """Add the overage item to a subscription if it's missing
+
+    Returns the item ID to record in the user's addon items
+    """
+    sub_id = _subscription(user)
+    sub = stripe.Subscription.retrieve(sub_id)
+    for item in sub["items"]["data"]:
+        if item["price"]["id"] == addon["stripe_id"]:
+            break
+    else:
+        item = stripe.SubscriptionItem.create(
+            subscription=sub_id, price=addon["stripe_id"]
+        )
+    return {f"stripe.addon_items.{addon['key']}": item["id"]}
+
+
+def plan_operation(value: Optional[str], use_stripe: bool):
+    """Returns the local update and optional Stripe call for a plan change"""
+    plan = mdb.account.plan.find_one({"key": value}, {"_id": 0, "updated": 0})
+    if not plan:
+        raise ValueError(f"No plan found for {value}")
+
+    def update(user: dict) -> Optional[dict]:
+        if (user.get("plan") or {}).get("key") == value:
+            return None
+        if plan.get("stripe_id") or not _subscription(user):
+            return _set({"plan": plan})
+        # The subscription would keep billing for a plan without a price
+        if not use_stripe:
+            print(f"Skipping {user['email']}. Add --stripe-changes to cancel")
+            return None
+        return {
+            "$set": {
+                "plan": plan,
+                "stripe.subscription_id": None,
+                "stripe.subscription_item_id": None,
+                "stripe.addon_items": {},
+            },
+            "$pull": {"tokens": {"type": "dev"}},
+        }
+
+    def remote(user: dict):
+        if not _subscription(user):
+            return
+        if plan.get("stripe_id"):
+            stripe_change_plan(user, plan)
+        else:
+            stripe_cancel(user)
+
+    return update, remote if use_stripe else None
+
+
+def overage_operation():
+    """Returns the local update and Stripe call to allow overage"""
+    addon = mdb.account.addon.find_one({"key": "overage"}, {"_id": 0})
+    if not addon or not addon.get("stripe_id"):
+        raise ValueError("No overage addon with a Stripe price found")
+
+    def update(user: dict) -> Optional[dict]:
+        if user.get("allow_overage"):
+            return None
+        # Matches the view. Overage requires a paid subscription
+        if not _subscription(user):
+            return None
+        return _set({"allow_overage": True})
+
+    def remote(user: dict) -> Optional[Dict[str, str]]:
+        if not user.get("allow_overage") and _subscription(user):
+            return stripe_add_overage(user, addon)
+        return None
+
+    return update, remote
+
+
+def _flag(field: str, value) -> Callable:
+    def update(user: dict) -> Optional[dict]:
+        if user.get(field) == value:
+            return None
+        return _set({field: value})
+
+    return update
+
+
+def _verify(user: dict) -> Optional[dict]:
+    if user.get("email_confirmed_at"):
+        return None
+    return _set({"email_confirmed_at": datetime.utcnow()})
+
+
+def _revoke(user: dict) -> Optional[dict]:
+    if not any(t.get("active") for t in user.get("tokens", [])):
+        return None
+    return _set({"tokens.$[].active": False})
+
+
+def get_operation(operation: str, value: Optional[str], use_stripe: bool):
+    """Returns the local update builder and optional Stripe call"""
+    if operation == "plan":
+        return plan_operation(value, use_stripe)
+    if operation == "overage-on":
+        return overage_operation()
+    simple = {
+        "verify": _verify,
+        "disable": _flag("disabled", True),
+        "enable": _flag("disabled", False),
+        "revoke": _revoke,
+        "overage-off": _flag("allow_overage", False),
+    }
+    if operation not in simple:
+        raise ValueError(f"Unknown operation {operation}")
+    return simple[operation], None
+
+
+def apply(
+    users: Iterator[dict],
+    update: Callable,
+    remote: Optional[Callable],
+    dry_run: bool,
+    workers: int,
+    rate: float,
+) -> Counter:
+    """Run Stripe calls and bulk writes for each batch of users
+
+    Stripe calls can return extra fields to set on the user
+    """
+    summary = Counter()
+    limiter = RateLimiter(rate)
+
+    def call(user: dict) -> Optional[dict]:
+        limiter.wait()
+        try:
+            return remote(user) or {}
+        except stripe.error.StripeError as exc:
+            print(f"{user['email']}: Stripe error {exc.user_message or exc}")
+            return None
+
+    def flush(batch: List[dict]):
+        ops = [(user, update(user)) for user in batch]
+        pending = [(user, op) for user, op in ops if op is not None]
+        summary["unchanged"] += len(ops) - len(pending)
+        if dry_run:
+            for user, _ in pending:
+                print(f"Would update {user['email']}")
+            summary["would update"] += len(pending)
+            return
+        if remote:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(call, [user for user, _ in pending]))
+            summary["stripe failed"] += results.count(None)
+            pending = [
+                (user, {**op, "$set": {**op.get("$set", {}), **extra}})
+                for (user, op), extra in zip(pending, results)
+                if extra is not None
+            ]
+        if pending:
+            ops = [UpdateOne({"_id": user["_id"]}, op) for user, op in pending]
+            resp = mdb.account.user.bulk_write(ops, ordered=False)
+            summary["updated"] += resp.modified_count
+
+    batch = []
+    for user in users:
+        summary["matched"] += 1
+        batch.append(user)
+        if len(batch) >= BATCH_SIZE:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    return summary
+
+
+@begin.start
+def main(
+    operation: "plan, verify, disable, enable, revoke, overage-on, or overage-off",
+    *targets: "Emails, customer IDs, or plan keys",
+    by: "Target type: email, customer, or plan" = "email",
+    file: "File with one target per line" = None,
+    query: "Raw JSON user filter" = None,
+    value: "Plan key for the plan operation" = None,
+    stripe_changes: "Also update Stripe subscriptions for plan changes" = False,
+    dry_run: "Show what would change without writing" = False,
+    workers: "Concurrent Stripe calls" = 8,
+    rate: "Max Stripe calls per second" = 20,
+) -> int:
+    """Apply an admin operation to many accounts at once"""
+    if by not in TARGETS:
+        print(f"Unknown target type {by}")
+        return 2
+    stripe.api_key = environ.get("STRIPE_SECRET_KEY")
+    targets = load_targets(targets, file)
+    try:
+        update, remote = get_operation(operation, value, stripe_changes)
+        users = find_users(by, targets, query)
+    except ValueError as exc:
+        print(exc)
+        return 2
+    found = set()
+    if by != "plan":
+        field = "email" if by == "email" else "customer_id"
+
+        def record(cursor):
+            for user in cursor:
+                source = user if by == "email" else user.get("stripe") or {}
+                found.add(source.get(field))
+                yield user
+
+        users = record(users)
+    summary = apply(users, update, remote, dry_run, int(workers), float(rate))
+    print(f"\n{operation} summary" + (" (dry run)" if dry_run else ""))
+    for key, count in sorted(summary.items()):
+        print(f"  {key}: {count}")
+    if by != "plan" and targets:
+        missing = [t for t in targets if t not in found]
+        print(f"  not found: {len(missing)}")
+        for target in missing:
+            print(f"    {target}")
+    return 1 if summary["stripe failed"] else 0
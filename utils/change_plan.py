@@ -21,7 +21,7 @@ def change_plan(email: str, plan: str) -> int:
     Does not touch Stripe fields
     """
     mdb = MongoClient(environ["MONGO_URI"])
-    plan_data = mdb.account.plan.find_one({"key": plan}, {"_id": 0})
+    plan_data = mdb.account.plan.find_one({"key": plan}, {"_id": 0, "updated": 0})
     if not plan_data:
         print(f"No plan found for {plan}")
         return 1
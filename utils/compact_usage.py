@@ -0,0 +1,30 @@
+"""
+Roll hourly token usage into daily totals after the retention period
+
+Run daily. Run from the project root with PYTHONPATH=.
+"""
+
+# stdlib
+from datetime import datetime, timedelta
+from os import environ
+
+# library
+import begin
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# module
+from avwx_account.usage import HourlyStore, get_store
+
+
+@begin.start
+def main(
+    days: "Days of hourly counts to keep" = environ.get("USAGE_HOURLY_RETENTION", 7),
+    batch_size: "Documents per batch" = 1000,
+) -> int:
+    """Roll hourly token usage into daily totals after the retention period"""
+    cutoff = datetime.utcnow() - timedelta(days=int(days))
+    count = HourlyStore().compact(get_store(), cutoff, int(batch_size))
+    print(f"Compacted {count} hourly documents before {cutoff.date()}")
+    return 0
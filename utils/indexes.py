@@ -0,0 +1,36 @@
+"""
+Declare, diff, build, and verify the account database indexes
+
+Run from the project root with PYTHONPATH=.
+"""
+
+# library
+import begin
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# module
+from avwx_account.indexes import build, diff, verify
+
+
+@begin.start
+def main(command: "diff, build, or verify" = "diff") -> int:
+    """Manage the declared account database indexes"""
+    if command == "diff":
+        for collection, changes in diff().items():
+            for spec in changes["missing"]:
+                print(f"{collection}: missing {spec['fields']}")
+            for name in changes["extra"]:
+                print(f"{collection}: undeclared {name}")
+    elif command == "build":
+        print(f"{build()} indexes building")
+    elif command == "verify":
+        failed = verify()
+        for collection, query in failed:
+            print(f"{collection}: not index-backed {query}")
+        return 1 if failed else 0
+    else:
+        print(f"Unknown command {command}")
+        return 2
+    return 0
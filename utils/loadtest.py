@@ -0,0 +1,258 @@
+"""
+Load test a running portal with synthetic users
+
+Seeds a local Mongo with the benchmark data, signs in one session per
+virtual user, and drives a weighted mix of page views, chart data, token
+changes, and signed Stripe webhooks against --host. Reports throughput
+and latency percentiles per route to size workers, threads, and pools
+
+Run the target with the same MONGO_URI and STRIPE_SIGN_SECRET and with
+RATELIMIT_ENABLED=false so token changes aren't throttled.
+Run from the project root with PYTHONPATH=.
+"""
+
+# stdlib
+import hashlib
+import hmac
+import json
+import random
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from os import environ
+from time import perf_counter, time
+from typing import Callable, Dict, List, Tuple
+
+# library
+import begin
+import requests
+from bson import ObjectId
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# module
+from avwx_account import create_app, mdb
+from avwx_account.seed import seed
+
+PASSWORD = "loadtest"
+
+CSRF = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+TOKEN_VALUE = re.compile(r"/token/edit\?value=([\w-]+)")
+
+# (route, elapsed seconds, status code)
+Sample = Tuple[str, float, int]
+
+
+def prepare_users(count: int) -> List[dict]:
+    """Give confirmed seeded users a known password. Returns their IDs and emails"""
+    app = create_app()
+    with app.app_context():
+        password = app.user_manager.hash_password(PASSWORD)
+    users = list(
+        mdb.account.user.find({"email_confirmed_at": {"$exists": True}}, {"email": 1})
+        .sort("_id", 1)
+        .limit(count)
+    )
+    mdb.account.user.update_many(
+        {"_id": {"$in": [u["_id"] for u in users]}}, {"$set": {"password": password}}
+    )
+    return users
+
+
+class VirtualUser:
+    """A signed in session that records the timing of each request"""
+
+    def __init__(self, host: str, user: dict, secret: str):
+        self.host = host.rstrip("/")
+        self.user = user
+        self.secret = secret
+        self.session = requests.Session()
+        self.samples: List[Sample] = []
+
+    def request(self, method: str, route: str, path: str = None, **kwargs):
+        start = perf_counter()
+        resp = self.session.request(
+            method, self.host + (path or route), allow_redirects=False, **kwargs
+        )
+        self.samples.append(
+            (f"{method} {route}", perf_counter() - start, resp.status_code)
+        )
+        return resp
+
+    def login(self):
+        page = self.request("GET", "/user/sign-in")
+        csrf = CSRF.search(page.text)
+        data = {"email": self.user["email"], "password": PASSWORD}
+        if csrf:
+            data["csrf_token"] = csrf.group(1)
+        resp = self.request("POST", "/user/sign-in", data=data)
+        if resp.status_code != 302:
+            raise ValueError(f"Sign in failed for {self.user['email']}")
+
+    def manage(self):
+        self.request("GET", "/manage")
+
+    def usage(self):
+        self.request("GET", "/token/usage")
+        self.request("GET", "/token/usage/data")
+        self.request("GET", "/token/usage/data?period=hour")
+
+    def _newest_token(self) -> str:
+        values = TOKEN_VALUE.findall(self.request("GET", "/manage").text)
+        return values[-1] if values else None
+
+    def tokens(self):
+        """Create, edit, refresh, and delete an app token"""
+        self.request("GET", "/token/new")
+        value = self._newest_token()
+        if not value or value.startswith("dev-"):
+            return
+        path = f"/token/edit?value={value}"
+        self.request("GET", "/token/edit", path)
+        self.request("POST", "/token/edit", path, data={"name": "Load", "active": "on"})
+        self.request("GET", "/token/refresh", f"/token/refresh?value={value}")
+        value = self._newest_token()
+        if value and not value.startswith("dev-"):
+            self.request("GET", "/token/delete", f"/token/delete?value={value}")
+
+    def webhook(self):
+        """Post a signed checkout completion for this user"""
+        payload = json.dumps(
+            {
+                "id": f"evt_{ObjectId()}",
+                "object": "event",
+                "type": "checkout.session.completed",
+                "data": {
+                    "object": {
+                        "client_reference_id": str(self.user["_id"]),
+                        "customer": "cus_load",
+                        # Expanded so the portal doesn't call Stripe
+                        "subscription": {
+                            "id": "sub_load",
+                            "items": {"data": [{"id": "si_load"}]},
+                        },
+                        "display_items": [{"plan": {"id": "price_pro"}}],
+                    }
+                },
+            }
+        )
+        stamp = int(time())
+        digest = hmac.new(
+            self.secret.encode(), f"{stamp}.{payload}".encode(), hashlib.sha256
+        ).hexdigest()
+        headers = {
+            "Content-Type": "application/json",
+            "Stripe-Signature": f"t={stamp},v1={digest}",
+        }
+        self.request("POST", "/stripe/fulfill", data=payload, headers=headers)
+
+
+# Relative frequency of each scenario
+SCENARIOS: Dict[str, Tuple[Callable[[VirtualUser], None], int]] = {
+    "manage": (VirtualUser.manage, 5),
+    "usage": (VirtualUser.usage, 3),
+    "tokens": (VirtualUser.tokens, 1),
+    "webhook": (VirtualUser.webhook, 1),
+}
+
+
+def drive(vuser: VirtualUser, until: float) -> List[Sample]:
+    """Run random scenarios until the deadline"""
+    funcs = [func for func, _ in SCENARIOS.values()]
+    weights = [weight for _, weight in SCENARIOS.values()]
+    while perf_counter() < until:
+        random.choices(funcs, weights)[0](vuser)
+    return vuser.samples
+
+
+def percentile(times: List[float], q: float) -> float:
+    return times[int(q * (len(times) - 1))] * 1000
+
+
+def summarize(samples: List[Sample], seconds: float) -> Dict[str, dict]:
+    """Returns throughput, errors, and latency percentiles per route"""
+    routes = defaultdict(list)
+    errors = defaultdict(int)
+    for route, elapsed, status in samples:
+        routes[route].append(elapsed)
+        if status >= 500:
+            errors[route] += 1
+    ret = {}
+    for route, times in sorted(routes.items()):
+        times.sort()
+        ret[route] = {
+            "requests": len(times),
+            "errors": errors[route],
+            "rps": len(times) / seconds,
+            "p50": percentile(times, 0.5),
+            "p95": percentile(times, 0.95),
+            "p99": percentile(times, 0.99),
+        }
+    return ret
+
+
+def report(results: Dict[str, dict], seconds: float):
+    """Print a table of per route results"""
+    print(
+        f"\n{'route':<28}{'reqs':>8}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+    )
+    for route, stats in results.items():
+        print(
+            f"{route:<28}{stats['requests']:>8}{stats['errors']:>6}"
+            f"{stats['rps']:>9.1f}{stats['p50']:>9.1f}{stats['p95']:>9.1f}"
+            f"{stats['p99']:>9.1f}"
+        )
+    total = sum(s["requests"] for s in results.values())
+    print(f"\n{total} requests in {seconds:.1f}s ({total / seconds:.1f} req/s)")
+
+
+@begin.start
+def main(
+    host: "Portal base URL" = "http://localhost:8000",
+    concurrency: "Virtual users" = 20,
+    duration: "Seconds to run" = 60,
+    users: "Seeded user count" = 10_000,
+    usage_rows: "Seeded account.token row count" = 500_000,
+    skip_seed: "Reuse the existing seeded data" = False,
+    output: "Results JSON path" = "",
+) -> int:
+    """Load test a running portal with synthetic users"""
+    concurrency = int(concurrency)
+    if not skip_seed:
+        print("Seeding database")
+        seed(int(users), int(usage_rows))
+    accounts = prepare_users(concurrency)
+    secret = environ["STRIPE_SIGN_SECRET"]
+    vusers = [VirtualUser(host, user, secret) for user in accounts]
+    print(f"Signing in {len(vusers)} users")
+    with ThreadPoolExecutor(concurrency) as pool:
+        start = perf_counter()
+        list(pool.map(VirtualUser.login, vusers))
+        logins = summarize(
+            [s for v in vusers for s in v.samples], perf_counter() - start
+        )
+        for vuser in vusers:
+            vuser.samples = []
+        print(f"Running for {duration}s against {host}")
+        start = perf_counter()
+        until = start + float(duration)
+        batches = pool.map(lambda v: drive(v, until), vusers)
+        samples = [sample for batch in batches for sample in batch]
+    seconds = perf_counter() - start
+    results = summarize(samples, seconds)
+    report(results, seconds)
+    if output:
+        data = {
+            "created": datetime.now(tz=timezone.utc).isoformat(),
+            "host": host,
+            "concurrency": concurrency,
+            "seconds": seconds,
+            "logins": logins,
+            "results": results,
+        }
+        with open(output, "w") as fout:
+            json.dump(data, fout, indent=2)
+        print(f"Saved results to {output}")
+    return 1 if any(s["errors"] for s in results.values()) else 0
@@ -1,37 +1,106 @@
 """
 Move and reformat tokens into account db
+
+The old_id map is loaded once and passed to each worker in a process
+pool. Each worker copies one _id range of counter.token with unordered
+bulk upserts. Counts are only ever raised with $max, so reruns are safe
+and days the API has already counted aren't lowered
 """
 
 # stdlib
 from datetime import datetime
-from os import environ
+from multiprocessing import Pool
+from os import cpu_count, environ
+from time import perf_counter
+from typing import Dict, List, Tuple
 
 # library
+import begin
 from dotenv import load_dotenv
 from pymongo import MongoClient, UpdateOne
 
 load_dotenv()
 
+BATCH_SIZE = 10000
 
-def main() -> int:
-    """Move and reformat tokens into account db"""
+# Set in each worker by the pool initializer
+USERS: Dict = {}
+
+
+def init_worker(users: Dict):
+    """Receive the user map. Works with both fork and spawn start methods"""
+    USERS.update(users)
+
+
+def load_users(mdb: MongoClient) -> Dict:
+    """Returns old user IDs mapped to the new user and app token IDs"""
+    ret = {}
+    cursor = mdb.account.user.find(
+        {"old_id": {"$exists": 1}}, {"old_id": 1, "tokens._id": 1, "tokens.type": 1}
+    )
+    for user in cursor:
+        tokens = [t["_id"] for t in user.get("tokens", []) if t.get("type") != "dev"]
+        ret[user["old_id"]] = (user["_id"], tokens[0] if tokens else None)
+    return ret
+
+
+def partitions(mdb: MongoClient, count: int) -> List[Tuple]:
+    """Split counter.token into _id ranges of roughly equal size"""
+    buckets = mdb.counter.token.aggregate(
+        [{"$bucketAuto": {"groupBy": "$_id", "buckets": count}}]
+    )
+    ranges = [[b["_id"]["min"], b["_id"]["max"], "$lt"] for b in buckets]
+    # Bucket maximums are exclusive except for the last one
+    if ranges:
+        ranges[-1][2] = "$lte"
+    return [tuple(r) for r in ranges]
+
+
+def move_range(bounds: Tuple) -> Tuple[int, int]:
+    """Copy one _id range. Returns the legacy documents and rows written"""
     mdb = MongoClient(environ["MONGO_URI"])
-    for token in mdb.counter.token.find():
-        user = mdb.account.user.find_one({"old_id": token["_id"]}, {"_id": 1})
+    low, high, upper = bounds
+    docs, rows, ops = 0, 0, []
+    for token in mdb.counter.token.find({"_id": {"$gte": low, upper: high}}):
+        docs += 1
+        user = USERS.get(token.pop("_id"))
         if not user:
             continue
-        del token["_id"]
-        counts = [
-            UpdateOne(
-                {"user_id": user["_id"], "date": datetime.strptime(k, r"%Y-%m-%d")},
-                {"$inc": {"count": v}},
-                upsert=True,
-            )
-            for k, v in token.items()
-        ]
-        mdb.account.token.bulk_write(counts, ordered=False)
-    return 0
+        user_id, token_id = user
+        for key, value in token.items():
+            query = {"user_id": user_id, "date": datetime.strptime(key, r"%Y-%m-%d")}
+            if token_id:
+                query["token_id"] = token_id
+            ops.append(UpdateOne(query, {"$max": {"count": value}}, upsert=True))
+        if len(ops) >= BATCH_SIZE:
+            mdb.account.token.bulk_write(ops, ordered=False)
+            rows += len(ops)
+            ops = []
+    if ops:
+        mdb.account.token.bulk_write(ops, ordered=False)
+        rows += len(ops)
+    mdb.close()
+    return docs, rows
 
 
-if __name__ == "__main__":
-    main()
+@begin.start
+def main(processes: "Worker processes" = cpu_count()) -> int:
+    """Move and reformat tokens into account db"""
+    processes = int(processes)
+    start = perf_counter()
+    mdb = MongoClient(environ["MONGO_URI"])
+    users = load_users(mdb)
+    ranges = partitions(mdb, processes * 4)
+    # Clients aren't fork safe, so each worker opens its own
+    mdb.close()
+    print(f"Loaded {len(users)} users in {perf_counter() - start:.1f}s")
+    docs, rows = 0, 0
+    with Pool(processes, initializer=init_worker, initargs=(users,)) as pool:
+        for done, written in pool.imap_unordered(move_range, ranges):
+            docs += done
+            rows += written
+            rate = rows / (perf_counter() - start)
+            print(f"{docs} tokens, {rows} rows ({rate:.0f} rows/s)")
+    elapsed = perf_counter() - start
+    print(f"Moved {rows} rows from {docs} tokens in {elapsed:.1f}s")
+    return 0
@@ -0,0 +1,210 @@
+"""
+Report daily token overage to Stripe as metered usage
+
+Overage is the app token calls beyond a user's plan limit for a UTC day.
+Reported days are recorded in account.overage so reruns skip them, and
+each usage record has an idempotency key in case a run dies between the
+Stripe call and the checkpoint
+
+Set STRIPE_API_BASE or --api-base to run against stripe-mock.
+Run from the project root with PYTHONPATH=.
+"""
+
+# stdlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from os import environ
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional
+
+# library
+import begin
+import stripe
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+load_dotenv()
+
+# module
+from avwx_account import mdb
+from avwx_account.limiter import RateLimiter
+
+BATCH_SIZE = 500
+
+
+def overage_users(batch_size: int) -> Iterator[List[dict]]:
+    """Yields batches of paying users who allow overage"""
+    cursor = mdb.account.user.find(
+        {"allow_overage": True, "stripe.subscription_id": {"$type": "string"}},
+        {"plan.limit": 1, "stripe": 1, "tokens._id": 1, "tokens.type": 1},
+        batch_size=batch_size,
+    )
+    batch = []
+    for user in cursor:
+        batch.append(user)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def daily_totals(users: List[dict], day: datetime) -> Dict:
+    """Returns app token call totals for the day keyed by user ID"""
+    # Dev tokens have their own cap and don't count toward the plan limit
+    # Excluding them rather than matching current app tokens still bills
+    # usage from app tokens deleted during the day
+    dev_tokens = [
+        token["_id"]
+        for user in users
+        for token in user.get("tokens", [])
+        if token.get("type") == "dev"
+    ]
+    rows = mdb.account.token.aggregate(
+        [
+            {
+                "$match": {
+                    "user_id": {"$in": [user["_id"] for user in users]},
+                    "date": day,
+                    "token_id": {"$nin": dev_tokens},
+                }
+            },
+            {"$group": {"_id": "$user_id", "count": {"$sum": "$count"}}},
+        ]
+    )
+    return {row["_id"]: row["count"] for row in rows}
+
+
+def reported(users: List[dict], day: datetime) -> set:
+    """Returns the user IDs already reported for the day"""
+    rows = mdb.account.overage.find(
+        {"user_id": {"$in": [user["_id"] for user in users]}, "date": day},
+        {"user_id": 1},
+    )
+    return {row["user_id"] for row in rows}
+
+
+def overage_item(user: dict, addon_price: str) -> Optional[str]:
+    """Returns the user's overage subscription item ID, looking it up if needed"""
+    item_id = (user["stripe"].get("addon_items") or {}).get("overage")
+    if item_id:
+        return item_id
+    sub = stripe.Subscription.retrieve(user["stripe"]["subscription_id"])
+    for item in sub["items"]["data"]:
+        if item["price"]["id"] == addon_price:
+            mdb.account.user.update_one(
+                {"_id": user["_id"]},
+                {"$set": {"stripe.addon_items.overage": item["id"]}},
+            )
+            return item["id"]
+    return None
+
+
+def report(user: dict, quantity: int, day: datetime, addon_price: str) -> str:
+    """Submit a usage record. Returns the status for the summary"""
+    try:
+        item_id = overage_item(user, addon_price)
+        if not item_id:
+            return "missing item"
+        stripe.SubscriptionItem.create_usage_record(
+            item_id,
+            quantity=quantity,
+            # Midday keeps the record inside the day's billing period
+            timestamp=int(
+                (day + timedelta(hours=12)).replace(tzinfo=timezone.utc).timestamp()
+            ),
+            action="increment",
+            idempotency_key=f"overage:{user['_id']}:{day.date()}",
+        )
+        return "reported"
+    except stripe.error.StripeError as exc:
+        print(f"{user['_id']}: Stripe error {exc.user_message or exc}")
+        return "failed"
+
+
+def run(day: datetime, dry_run: bool, workers: int, rate: float) -> Counter:
+    """Report overage for every eligible user in batches"""
+    addon = mdb.account.addon.find_one({"key": "overage"}, {"stripe_id": 1})
+    if not addon:
+        raise ValueError("No overage addon found")
+    summary = Counter()
+    limiter = RateLimiter(rate)
+
+    def submit(item: tuple) -> str:
+        user, quantity = item
+        limiter.wait()
+        return report(user, quantity, day, addon["stripe_id"])
+
+    for users in overage_users(BATCH_SIZE):
+        summary["users"] += len(users)
+        totals = daily_totals(users, day)
+        done = reported(users, day)
+        summary["already reported"] += len(done)
+        pending = []
+        for user in users:
+            if user["_id"] in done:
+                continue
+            limit = (user.get("plan") or {}).get("limit") or 0
+            quantity = totals.get(user["_id"], 0) - limit
+            if quantity > 0:
+                pending.append((user, quantity))
+        summary["over limit"] += len(pending)
+        if dry_run:
+            for user, quantity in pending:
+                print(f"Would report {quantity} for {user['_id']}")
+            continue
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(submit, pending))
+        summary.update(results)
+        ops = [
+            UpdateOne(
+                {"user_id": user["_id"], "date": day},
+                {
+                    "$setOnInsert": {
+                        "quantity": quantity,
+                        "reported_at": datetime.utcnow(),
+                    }
+                },
+                upsert=True,
+            )
+            for (user, quantity), status in zip(pending, results)
+            if status == "reported"
+        ]
+        if ops:
+            mdb.account.overage.bulk_write(ops, ordered=False)
+        summary["calls"] += sum(
+            q for (_, q), s in zip(pending, results) if s == "reported"
+        )
+    return summary
+
+
+@begin.start
+def main(
+    day: "UTC day to report as YYYY-MM-DD. Defaults to yesterday" = None,
+    dry_run: "Show overage without reporting it" = False,
+    workers: "Concurrent Stripe calls" = 8,
+    rate: "Max Stripe calls per second" = 20,
+    api_base: "Stripe API base URL" = environ.get("STRIPE_API_BASE"),
+) -> int:
+    """Report daily token overage to Stripe as metered usage"""
+    stripe.api_key = environ.get("STRIPE_SECRET_KEY")
+    if api_base:
+        stripe.api_base = api_base
+    if day:
+        day = datetime.strptime(day, "%Y-%m-%d")
+    else:
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        day = today - timedelta(days=1)
+    start = perf_counter()
+    try:
+        summary = run(day, dry_run, int(workers), float(rate))
+    except ValueError as exc:
+        print(exc)
+        return 2
+    elapsed = perf_counter() - start
+    print(f"\nOverage for {day.date()}" + (" (dry run)" if dry_run else ""))
+    for key, count in sorted(summary.items()):
+        print(f"  {key}: {count}")
+    print(f"  elapsed: {elapsed:.1f}s")
+    return 1 if summary["failed"] or summary["missing item"] else 0
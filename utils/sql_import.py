@@ -0,0 +1,43 @@
+"""
+Stream a SQL table into a Mongo collection
+
+See avwx_account/sql_import.py for the batching and checkpoints
+"""
+
+# stdlib
+import json
+from os import environ
+
+# library
+import begin
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# module
+from avwx_account import mdb
+from avwx_account.sql_import import report, run_import
+
+
+@begin.start
+def main(
+    table: "Source table",
+    collection: "Target collection in the account db",
+    columns: "JSON file mapping target fields to source columns",
+    pk: "Ordered unique key column for checkpoints" = "id",
+    batch_size: "Rows per fetch and insert" = 5000,
+    reset: "Ignore the saved checkpoint" = False,
+) -> int:
+    """Stream a SQL table into a Mongo collection"""
+    with open(columns) as fin:
+        column_map = json.load(fin)
+    if reset:
+        mdb.account.migration.delete_one({"_id": f"sql:{table}:{collection}"})
+    conn = psycopg2.connect(environ.get("SQLALCHEMY_DATABASE_URI"))
+    try:
+        stats = run_import(conn, table, collection, column_map, pk, int(batch_size))
+    finally:
+        conn.close()
+    report(table, stats)
+    return 0
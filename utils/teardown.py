@@ -0,0 +1,51 @@
+"""
+Remove accounts that users have deleted
+
+delete_account disables the user and sets deleted_at. This cancels their
+subscription, removes them from the mailing list, deletes their usage
+rows in batches, and then deletes the user. Run it on a schedule.
+Run from the project root with PYTHONPATH=.
+"""
+
+# stdlib
+from collections import Counter
+from os import environ
+from time import perf_counter
+
+# library
+import begin
+import stripe
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# module
+from avwx_account.teardown import BATCH_SIZE, pending, teardown
+
+
+@begin.start
+def main(
+    limit: "Most accounts to remove. 0 for all" = 0,
+    batch_size: "Usage rows per delete" = BATCH_SIZE,
+    dry_run: "List the accounts without removing them" = False,
+) -> int:
+    """Remove accounts that users have deleted"""
+    stripe.api_key = environ.get("STRIPE_SECRET_KEY")
+    start = perf_counter()
+    summary = Counter()
+    for user in pending(int(limit)):
+        if dry_run:
+            print(f"{user['email']} deleted at {user['deleted_at']}")
+            summary["users"] += 1
+            continue
+        try:
+            summary.update(teardown(user, int(batch_size)))
+        except Exception as exc:  # pylint: disable=broad-except
+            # Left marked so the next run retries it
+            print(f"Failed {user['email']}: {exc}")
+            summary["failed"] += 1
+    print("\nTeardown" + (" (dry run)" if dry_run else ""))
+    for key, count in sorted(summary.items()):
+        print(f"  {key}: {count}")
+    print(f"  elapsed: {perf_counter() - start:.1f}s")
+    return 1 if summary["failed"] else 0
@@ -0,0 +1,34 @@
+"""
+Refill the pre-generated token pool
+
+Run every few minutes. Each type is topped up to the target once it
+drops below the low water mark
+Run from the project root with PYTHONPATH=.
+"""
+
+# stdlib
+from os import environ
+
+# library
+import begin
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# module
+from avwx_account import token_pool
+
+
+@begin.start
+def main(
+    low: "Refill a type below this many values" = environ.get("TOKEN_POOL_LOW", 200),
+    target: "Values to keep per type" = environ.get("TOKEN_POOL_TARGET", 1000),
+) -> int:
+    """Refill the pre-generated token pool"""
+    for type, count in token_pool.depth().items():
+        if count >= int(low):
+            print(f"{type}: {count}")
+            continue
+        added = token_pool.refill(type, int(target))
+        print(f"{type}: {count} + {added}")
+    return 0
@@ -0,0 +1,89 @@
+"""
+Copy daily token usage into the token_usage time-series collection
+
+Rows are read in user order and each batch holds every row for its
+users, so the totals passed to TimeSeriesStore.reconcile are complete.
+Progress is checkpointed by the last user copied, so an interrupted copy
+resumes where it left off and replaying a batch never inflates counts
+Run from the project root with PYTHONPATH=.
+"""
+
+# stdlib
+from time import perf_counter
+
+# library
+import begin
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# module
+from avwx_account import mdb
+from avwx_account.usage import TimeSeriesStore
+
+CHECKPOINT = "usage_timeseries"
+
+
+def _checkpoint() -> dict:
+    return mdb.account.migration.find_one({"_id": CHECKPOINT}) or {}
+
+
+def migrate(batch_size: int) -> int:
+    """Copy account.token rows after the last checkpoint. Returns the count"""
+    store = TimeSeriesStore()
+    if store.create():
+        print(f"Created {store.collection}")
+    query = {}
+    last_user = _checkpoint().get("last_user")
+    if last_user:
+        query["user_id"] = {"$gt": last_user}
+        print(f"Resuming after user {last_user}")
+    # Served by the user_id, date, token_id index
+    cursor = mdb.account.token.find(query, sort=[("user_id", 1)], batch_size=batch_size)
+    count, rows, batch, current = 0, 0, {}, None
+
+    def flush():
+        # Only the shortfall is inserted, so a batch replayed after a crash
+        # between the insert and the checkpoint isn't counted twice
+        totals = [
+            {"user_id": user_id, "token_id": token_id, "date": day, "count": total}
+            for (user_id, token_id, day), total in batch.items()
+        ]
+        store.reconcile(totals)
+        mdb.account.migration.update_one(
+            {"_id": CHECKPOINT}, {"$set": {"last_user": current}}, upsert=True
+        )
+        batch.clear()
+        print(count)
+
+    for row in cursor:
+        # Only flush between users so no day total is split across batches
+        if row["user_id"] != current:
+            if rows >= batch_size:
+                flush()
+                rows = 0
+            current = row["user_id"]
+        # Legacy rows from before per-token counts have no token_id
+        key = (row["user_id"], row.get("token_id"), row["date"])
+        batch[key] = batch.get(key, 0) + row["count"]
+        count += 1
+        rows += 1
+    if batch:
+        flush()
+    return count
+
+
+@begin.start
+def main(
+    batch_size: "Rows per insert" = 5000,
+    reset: "Drop the collection and checkpoint first" = False,
+) -> int:
+    """Copy daily token usage into the token_usage time-series collection"""
+    if reset:
+        mdb.account.drop_collection(TimeSeriesStore.collection)
+        mdb.account.migration.delete_one({"_id": CHECKPOINT})
+    start = perf_counter()
+    count = migrate(int(batch_size))
+    elapsed = perf_counter() - start
+    print(f"Copied {count} rows in {elapsed:.1f}s")
+    return 0
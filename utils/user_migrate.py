@@ -1,7 +1,7 @@
 """
 Copy all users from sql to mongo
 
-Move to root to import mongoengine models
+Run from the project root with PYTHONPATH=.
 """
 
 # stdlib
@@ -10,13 +10,14 @@ from typing import List
 
 # library
 import psycopg2
+from bson import ObjectId
 from dotenv import load_dotenv
 
 load_dotenv()
 
 # module
-from avwx_account.models import PlanEmbedded, Token, Stripe, User
-
+from avwx_account.models import PlanEmbedded, Stripe, Token, User
+from avwx_account.sql_import import report, run_import
 
 USER_FIELDS = {
     "old_id": 0,
@@ -26,12 +27,12 @@ USER_FIELDS = {
     "password": 4,
     "first_name": 5,
     "last_name": 6,
+    "stripe.customer_id": 9,
+    "stripe.subscription_id": 10,
 }
 
 TOKEN_FIELDS = {"active": 7, "value": 8}
 
-STRIPE_FIELDS = {"customer_id": 9, "subscription_id": 10}
-
 PLAN_FIELDS = {
     "key": 1,
     "name": 2,
@@ -59,31 +60,37 @@ def fill_model(data: List[str], fields: dict, model: "mongo model") -> "mongo mo
 
 
 def get_plans(cur):
-    """Populate the plan embedded dict"""
+    """Populate the embedded plan dict"""
     cur.execute("SELECT * FROM public.plan;")
     for plan in cur.fetchall():
         PLANS[plan[0]] = fill_model(plan, PLAN_FIELDS, PlanEmbedded)
 
 
-def handle_user(data: List[str]):
-    """Convert user SQL query into a mongo document and save"""
-    user = fill_model(data, USER_FIELDS, User)
-    user.stripe = fill_model(data, STRIPE_FIELDS, Stripe)
-    user.token = fill_model(data, TOKEN_FIELDS, Token)
-    user.plan = PLANS.get(data[13])
-    user.save()
+def finalize_user(doc: dict, row: tuple) -> dict:
+    """Build the raw document through the model so it gets the field defaults"""
+    stripe = doc.pop("stripe", None)
+    user = User(
+        **{k: v for k, v in doc.items() if k in User._fields},
+        stripe=Stripe(**stripe) if stripe else None,
+        plan=PLANS.get(row[13]),
+    )
+    token = {k: row[i] for k, i in TOKEN_FIELDS.items()}
+    if token["value"]:
+        user.tokens = [Token(_id=ObjectId(), name="Token", type="app", **token)]
+    ret = user.to_mongo().to_dict()
+    # Not a model field, but kept to trace users back to the old table
+    ret["old_id"] = doc["old_id"]
+    return ret
 
 
 def main() -> int:
     """Copy all users from sql to mongo"""
     conn = psycopg2.connect(environ.get("SQLALCHEMY_DATABASE_URI"))
-    cur = conn.cursor()
-    get_plans(cur)
-    cur.execute("SELECT * FROM public.user;")
-    for user in cur.fetchall():
-        handle_user(user)
-    cur.close()
+    with conn.cursor() as cur:
+        get_plans(cur)
+    stats = run_import(conn, "public.user", "user", USER_FIELDS, finalize=finalize_user)
     conn.close()
+    report("public.user", stats)
     return 0
 
 